@@ -18,6 +18,7 @@ from kivy.clock import Clock
 import requests
 import json
 import os
+import threading
 
 # API Configuration
 API_BASE_URL = os.getenv("API_BASE_URL", "https://speakeasy-python-web-vlxo5frhwq-uc.a.run.app")
@@ -235,6 +236,7 @@ class PracticeScreen(Screen):
 
         # Scroll to bottom
         Clock.schedule_once(lambda dt: setattr(self.chat_scroll, 'scroll_y', 0), 0.1)
+        return msg_label
 
     def update_rect(self, instance, value):
         instance.rect.pos = instance.pos
@@ -252,46 +254,66 @@ class PracticeScreen(Screen):
         # Add to history
         self.conversation_history.append({'role': 'user', 'content': message})
 
-        # Show loading
-        self.add_chat_message('assistant', 'Thinking...')
+        # Show loading; streamed tokens replace this text as they arrive
+        reply_label = self.add_chat_message('assistant', 'Thinking...')
 
-        # Fetch response
-        Clock.schedule_once(lambda dt: self._fetch_response(message), 0.1)
+        # Stream the response off the UI thread
+        language = self.language_spinner.text
+        history = list(self.conversation_history)
+        threading.Thread(
+            target=self._stream_response,
+            args=(message, language, history, reply_label),
+            daemon=True
+        ).start()
 
-    def _fetch_response(self, message):
+    def _stream_response(self, message, language, history, reply_label):
+        tokens = []
         try:
-            language = self.language_spinner.text
-
             response = requests.post(
-                f'{API_BASE_URL}/api/practice/chat',
+                f'{API_BASE_URL}/api/practice/chat/stream',
                 json={
                     'message': message,
                     'target_language': language,
-                    'conversation_history': self.conversation_history
+                    'conversation_history': history
                 },
+                stream=True,
                 timeout=30
             )
 
-            # Remove loading message
-            if len(self.chat_layout.children) > 0:
-                self.chat_layout.remove_widget(self.chat_layout.children[0])
-
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('success'):
-                    assistant_msg = data['message']
-                    self.conversation_history.append({'role': 'assistant', 'content': assistant_msg})
-                    self.add_chat_message('assistant', assistant_msg)
+            if response.status_code != 200:
+                Clock.schedule_once(lambda dt: self._set_reply(reply_label, f'Error: {response.status_code}'))
+                return
+
+            # NDJSON events: token..., then done or error
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+
+                if event['type'] == 'token':
+                    tokens.append(event['content'])
+                    text = ''.join(tokens)
+                    Clock.schedule_once(lambda dt, text=text: self._set_reply(reply_label, text))
+                elif event['type'] == 'done':
+                    assistant_msg = event['message']
+                    Clock.schedule_once(lambda dt: self._finish_reply(reply_label, assistant_msg))
+                    return
                 else:
-                    self.add_chat_message('assistant', 'Sorry, I had trouble responding. Please try again.')
-            else:
-                self.add_chat_message('assistant', f'Error: {response.status_code}')
+                    break
+
+            Clock.schedule_once(lambda dt: self._set_reply(reply_label, 'Sorry, I had trouble responding. Please try again.'))
 
         except Exception as e:
-            # Remove loading message
-            if len(self.chat_layout.children) > 0:
-                self.chat_layout.remove_widget(self.chat_layout.children[0])
-            self.add_chat_message('assistant', f'Error: {str(e)}')
+            error = str(e)
+            Clock.schedule_once(lambda dt: self._set_reply(reply_label, f'Error: {error}'))
+
+    def _set_reply(self, reply_label, text):
+        reply_label.text = text
+        self.chat_scroll.scroll_y = 0
+
+    def _finish_reply(self, reply_label, assistant_msg):
+        self.conversation_history.append({'role': 'assistant', 'content': assistant_msg})
+        self._set_reply(reply_label, assistant_msg)
 
     def go_back(self, instance):
         self.manager.current = 'home'
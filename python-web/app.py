@@ -4,14 +4,17 @@ FastAPI backend with HTML/CSS/JavaScript frontend
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from contextlib import asynccontextmanager
+from typing import Optional, List
 import os
+import asyncio
+import json
 import openai
-from datetime import datetime
+from datetime import datetime, timedelta
 import jwt
 import time
 
@@ -25,9 +28,38 @@ except ImportError:
     print("Warning: google-auth not available. Google OAuth will use fallback mode.")
 
 # Import lessons data
-from lessons_data import LESSONS, get_lesson_by_id, get_lessons_by_level, get_all_lessons
-
-app = FastAPI(title="SpeakEasy Language Learning")
+from lessons_data import LESSONS, LESSON_CATALOG, get_lesson_by_id, thaw
+from services.leagues import LeagueTable
+from services import llm_service
+from services.response_cache import ResponseCache, make_key
+from services.story_pool import StoryPool, bucket_interests, bucket_key
+from services.single_flight import SingleFlight
+from services.prepared_response import PreparedPayload
+from services.grading import GradingEngine, PASSING_SCORE
+from services.static_cache import StaticCache
+from services.storage import DuplicateUserError, UnknownUserError, create_storage
+from services.xp_ledger import XPLedgerFull
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared clients on startup and release them on shutdown"""
+    await storage.init()
+    await register_guest()
+    storage.start()
+    if openai.api_key:
+        llm_service.init_client()
+        story_pool.start()
+    await asyncio.to_thread(static_cache.load)
+    static_cache.start()
+    yield
+    await static_cache.stop()
+    await story_pool.stop()
+    await llm_service.close_client()
+    await explain_cache.close()
+    await storage.stop()
+    await storage.close()
+
+app = FastAPI(title="SpeakEasy Language Learning", lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -41,6 +73,30 @@ app.add_middleware(
 # OpenAI configuration
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Word explanations repeat across learners; set REDIS_URL to share hits across instances
+explain_cache = ResponseCache(
+    "explain",
+    max_entries=int(os.getenv("EXPLAIN_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("EXPLAIN_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60))),
+    redis_url=os.getenv("REDIS_URL")
+)
+
+# The landing page and static files are served from memory, loaded at startup; STATIC_RELOAD=1 picks up edits in development
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+static_cache = StaticCache(
+    STATIC_DIR,
+    immutable_max_age=int(os.getenv("STATIC_ASSET_MAX_AGE", str(365 * 24 * 60 * 60))),
+    watch=os.getenv("STATIC_RELOAD", "").lower() in ("1", "true", "yes"),
+    poll_interval=float(os.getenv("STATIC_RELOAD_INTERVAL_SECONDS", "1")),
+    max_file_bytes=int(os.getenv("STATIC_CACHE_MAX_FILE_BYTES", str(256 * 1024)))
+)
+# Files too large for the cache (big images) are streamed from disk
+static_disk = StaticFiles(directory=STATIC_DIR, check_dir=False)
+
+# Identical prompts in flight at the same moment share one upstream call
+explain_flight = SingleFlight()
+story_flight = SingleFlight()
+
 # Data models
 class User(BaseModel):
     email: str
@@ -97,127 +153,186 @@ class QuizAnswer(BaseModel):
 class QuizSubmission(BaseModel):
     lesson_id: int
     answers: List[QuizAnswer]
+    completed_at: Optional[str] = None  # When an offline client finished the quiz
+
+class QuizBatchSubmission(BaseModel):
+    submissions: List[QuizSubmission]
 
-# In-memory storage (replace with database in production)
-users = {}
-usernames = set()  # Track usernames for uniqueness
 stories = {}
 conversations = {}
-user_lesson_progress = {}  # email -> {lesson_id: LessonProgress}
 
 # XP and Leagues system
+# Total XP places a user in at least min_xp's league; each week the top promotion_threshold
+# of a cohort move up one league and the bottom demotion_threshold move down one
 LEAGUES = {
-    'bronze': {'name': 'Bronze', 'min_xp': 0, 'max_xp': 499, 'color': '#CD7F32'},
-    'silver': {'name': 'Silver', 'min_xp': 500, 'max_xp': 1499, 'color': '#C0C0C0'},
-    'gold': {'name': 'Gold', 'min_xp': 1500, 'max_xp': 2999, 'color': '#FFD700'},
-    'diamond': {'name': 'Diamond', 'min_xp': 3000, 'max_xp': 5999, 'color': '#B9F2FF'},
-    'master': {'name': 'Master', 'min_xp': 6000, 'max_xp': float('inf'), 'color': '#9F00FF'}
+    'bronze': {'name': 'Bronze', 'min_xp': 0, 'max_xp': 499, 'color': '#CD7F32', 'promotion_threshold': 5, 'demotion_threshold': None},
+    'silver': {'name': 'Silver', 'min_xp': 500, 'max_xp': 1499, 'color': '#C0C0C0', 'promotion_threshold': 5, 'demotion_threshold': 5},
+    'gold': {'name': 'Gold', 'min_xp': 1500, 'max_xp': 2999, 'color': '#FFD700', 'promotion_threshold': 5, 'demotion_threshold': 5},
+    'diamond': {'name': 'Diamond', 'min_xp': 3000, 'max_xp': 5999, 'color': '#B9F2FF', 'promotion_threshold': 5, 'demotion_threshold': 5},
+    'master': {'name': 'Master', 'min_xp': 6000, 'max_xp': float('inf'), 'color': '#9F00FF', 'promotion_threshold': None, 'demotion_threshold': 5}
 }
+LEAGUE_TABLE = LeagueTable(LEAGUES)  # Sorted min_xp thresholds for bisect lookups
+LEADERBOARD_HISTORY_WEEKS = 12
+XP_ACTIVITY_MAX_DAYS = 366  # longest range GET /api/xp/activity charts
+
+# With the sql backend XP awards are buffered and written in bulk; XP_WRITE_BEHIND=0 writes each one in the request
+XP_WRITE_BEHIND = {
+    "flush_interval_ms": float(os.getenv("XP_FLUSH_INTERVAL_MS", "200")),
+    "batch_rows": int(os.getenv("XP_FLUSH_BATCH_ROWS", "500")),
+    "max_pending": int(os.getenv("XP_MAX_PENDING", "10000")),
+    "journal_path": os.getenv("XP_LEDGER_JOURNAL", "xp_ledger.journal")
+} if os.getenv("XP_WRITE_BEHIND", "true").lower() in ("1", "true", "yes") else None
+
+# Users, lesson progress, XP and weekly leaderboards; STORAGE_BACKEND=sql shares them across workers via DATABASE_URL
+storage = create_storage(
+    os.getenv("STORAGE_BACKEND", "memory"),
+    LEAGUES,
+    LESSON_CATALOG.lessons,
+    history_weeks=LEADERBOARD_HISTORY_WEEKS,
+    xp_write_behind=XP_WRITE_BEHIND
+)
 
-user_xp = {}  # email -> {'total_xp': int, 'weekly_xp': int, 'streak_days': int, 'last_active': str}
-weekly_leaderboard = []  # List of {email, username, weekly_xp, league}
+# Visitors who are not signed in share this account; it is registered at startup like any other user
+GUEST_EMAIL = "guest@example.com"
 
-import datetime
+async def register_guest():
+    """Create the shared guest account if it does not exist yet"""
+    if await storage.get_user(GUEST_EMAIL) is None:
+        try:
+            await storage.create_user({"email": GUEST_EMAIL, "target_language": "Spanish"})
+        except DuplicateUserError:
+            pass  # Another worker registered it first
 
 def get_week_number():
-    """Get current week number of the year"""
-    return datetime.datetime.now().isocalendar()[1]
+    """Get current (ISO year, ISO week) - the week number alone repeats every year"""
+    iso = datetime.utcnow().isocalendar()
+    return (iso[0], iso[1])
 
 current_week = get_week_number()
 
+def roll_week():
+    """Advance to the current ISO week; storage archives the finished week's leaderboard"""
+    global current_week
+    current_week = get_week_number()
+    return current_week
+
+async def current_leaderboard():
+    """This week's leaderboard"""
+    return await storage.leaderboard(roll_week())
+
+async def get_user_xp(email):
+    """Get a user's XP record, zeroing weekly XP if it was earned in an older week"""
+    roll_week()
+
+    xp_data = await storage.get_xp(email)
+    if xp_data and xp_data['week'] != current_week:
+        xp_data['weekly_xp'] = 0
+        xp_data['week'] = current_week
+        await storage.save_xp(email, xp_data)
+        await update_leaderboard(email, xp_data)
+    return xp_data
+
 def get_league_from_xp(total_xp):
     """Determine league based on total XP"""
-    for league_id, league_data in LEAGUES.items():
-        if league_data['min_xp'] <= total_xp <= league_data['max_xp']:
-            return league_id
-    return 'bronze'
+    return LEAGUE_TABLE.resolve(total_xp)
 
-def add_xp(email, xp_amount):
-    """Add XP to user and update league"""
-    global current_week
+async def get_user_league(email, total_xp):
+    """League a user competes in this week: their placement, or the one their total XP earns"""
+    return await (await current_leaderboard()).league_of(email) or get_league_from_xp(total_xp)
 
-    if email not in user_xp:
-        user_xp[email] = {
-            'total_xp': 0,
-            'weekly_xp': 0,
-            'streak_days': 1,
-            'last_active': datetime.datetime.utcnow().isoformat(),
-            'week': current_week
-        }
+@asynccontextmanager
+async def reserved_xp():
+    """Hold room for an XP award; answers 503 before anything is saved if XP writes are backed up"""
+    try:
+        async with storage.reserve_xp():
+            yield
+    except XPLedgerFull:
+        raise HTTPException(status_code=503, detail="XP is backed up, please retry shortly",
+                            headers={"Retry-After": "1"})
 
-    # Check if new week - reset weekly XP
-    if get_week_number() != current_week:
-        current_week = get_week_number()
-        for user_email in user_xp:
-            user_xp[user_email]['weekly_xp'] = 0
-            user_xp[user_email]['week'] = current_week
+async def add_xp(email, xp_amount, source="activity"):
+    """Add XP to user and update league"""
+    async with reserved_xp():
+        xp_data = await get_user_xp(email)
+        if xp_data is None:
+            xp_data = {
+                'total_xp': 0,
+                'weekly_xp': 0,
+                'streak_days': 1,
+                'last_active': datetime.utcnow().isoformat(),
+                'week': current_week
+            }
 
-    # Add XP
-    user_xp[email]['total_xp'] += xp_amount
-    user_xp[email]['weekly_xp'] += xp_amount
+        # Add XP
+        xp_data['total_xp'] += xp_amount
+        xp_data['weekly_xp'] += xp_amount
 
-    # Update streak
-    last_active = datetime.datetime.fromisoformat(user_xp[email]['last_active'])
-    now = datetime.datetime.utcnow()
-    days_diff = (now - last_active).days
+        # Update streak
+        last_active = datetime.fromisoformat(xp_data['last_active'])
+        now = datetime.utcnow()
+        days_diff = (now - last_active).days
 
-    if days_diff == 1:
-        user_xp[email]['streak_days'] += 1
-    elif days_diff > 1:
-        user_xp[email]['streak_days'] = 1
+        if days_diff == 1:
+            xp_data['streak_days'] += 1
+        elif days_diff > 1 or not xp_data['streak_days']:
+            xp_data['streak_days'] = 1
 
-    user_xp[email]['last_active'] = now.isoformat()
+        xp_data['last_active'] = now.isoformat()
+        try:
+            await storage.save_xp(email, xp_data, xp_amount, source)
+        except UnknownUserError:
+            raise HTTPException(status_code=404, detail="User not found")
 
     # Update leaderboard
-    update_leaderboard()
-
-def update_leaderboard():
-    """Update the weekly leaderboard"""
-    global weekly_leaderboard
-
-    leaderboard_data = []
-    for email, xp_data in user_xp.items():
-        user_data = users.get(email, {})
-        username = user_data.get('username', email.split('@')[0])
-        league = get_league_from_xp(xp_data['total_xp'])
-
-        leaderboard_data.append({
-            'email': email,
-            'username': username,
-            'weekly_xp': xp_data['weekly_xp'],
-            'total_xp': xp_data['total_xp'],
-            'league': league,
-            'streak_days': xp_data['streak_days']
-        })
+    await update_leaderboard(email, xp_data)
 
-    # Sort by weekly XP descending
-    weekly_leaderboard = sorted(leaderboard_data, key=lambda x: x['weekly_xp'], reverse=True)
+async def update_leaderboard(email, xp_data):
+    """Re-rank a single user on the weekly leaderboard"""
+    await storage.update_leaderboard(email, xp_data, get_league_from_xp(xp_data['total_xp']))
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
+async def root(request: Request):
     """Serve the main HTML page"""
-    with open("static/index.html", "r") as f:
-        return HTMLResponse(content=f.read())
+    payload = static_cache.get("index.html")
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return payload.respond(request)
 
 @app.get("/health")
 async def health():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
+@app.get("/api/metrics")
+async def metrics():
+    """Runtime metrics for the shared upstream clients"""
+    return {
+        "success": True,
+        "llm": llm_service.get_stats(),
+        "explain_cache": explain_cache.get_stats(),
+        "story_pool": story_pool.get_stats(),
+        "static_cache": static_cache.get_stats(),
+        "storage": storage.get_stats(),
+        "single_flight": {
+            "explain": explain_flight.get_stats(),
+            "story": story_flight.get_stats()
+        }
+    }
+
 @app.post("/api/auth/register")
 async def register(user: User):
     """Register a new user"""
-    if user.email in users:
+    if await storage.get_user(user.email):
         raise HTTPException(status_code=400, detail="User already exists")
 
     # Check username uniqueness if provided
-    if user.username:
-        if user.username in usernames:
-            raise HTTPException(status_code=400, detail="Username already taken")
-        usernames.add(user.username)
+    if user.username and await storage.username_exists(user.username):
+        raise HTTPException(status_code=400, detail="Username already taken")
 
-    user_data = user.dict()
-    users[user.email] = user_data
+    try:
+        user_data = await storage.create_user(user.dict())
+    except DuplicateUserError:
+        raise HTTPException(status_code=400, detail="User already exists")
 
     # Don't return password in response
     response_data = user_data.copy()
@@ -234,14 +349,14 @@ async def register(user: User):
 @app.post("/api/auth/check-username")
 async def check_username(request: UsernameCheck):
     """Check if username is available"""
-    available = request.username not in usernames
+    available = not await storage.username_exists(request.username)
 
     # Generate suggestion if taken
     suggestion = None
     if not available:
         base = request.username
         counter = 1
-        while f"{base}{counter}" in usernames:
+        while await storage.username_exists(f"{base}{counter}"):
             counter += 1
         suggestion = f"{base}{counter}"
 
@@ -304,20 +419,20 @@ async def google_auth(request: GoogleAuthRequest):
         else:
             base_username = email.split('@')[0]
 
-        # Ensure username is unique
-        username = base_username
-        counter = 1
-        while username in usernames:
-            username = f"{base_username}{counter}"
-            counter += 1
-
         # Check if user already exists
-        if email in users:
+        existing_user = await storage.get_user(email)
+        if existing_user:
             # Existing user - login
-            user_data = users[email].copy()
+            user_data = existing_user.copy()
         else:
+            # Ensure username is unique
+            username = base_username
+            counter = 1
+            while await storage.username_exists(username):
+                username = f"{base_username}{counter}"
+                counter += 1
+
             # New user - register
-            usernames.add(username)
             user_data = {
                 'email': email,
                 'username': username,
@@ -329,7 +444,7 @@ async def google_auth(request: GoogleAuthRequest):
                 'oauth_id': oauth_id,
                 'picture': picture
             }
-            users[email] = user_data
+            user_data = (await storage.create_user(user_data)).copy()
 
         # Don't return sensitive data
         response_data = user_data.copy()
@@ -350,11 +465,12 @@ async def google_auth(request: GoogleAuthRequest):
 @app.post("/api/auth/login")
 async def login(request: LoginRequest):
     """Login user (simplified - add proper auth in production)"""
-    if request.email not in users:
+    existing_user = await storage.get_user(request.email)
+    if not existing_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # In production, verify password hash here
-    user_data = users[request.email].copy()
+    user_data = existing_user.copy()
     if 'password' in user_data:
         del user_data['password']  # Don't return password
 
@@ -364,12 +480,76 @@ async def login(request: LoginRequest):
         "user": user_data
     }
 
+async def generate_story_live(target_language: str, level: str, interests: List[str]):
+    """Generate a story with the LLM and parse it into a story dict"""
+    interests_text = ", ".join(interests) if interests else "general topics"
+
+    prompt = f"""Create a short story in {target_language} for a {level} level learner.
+
+The story should:
+- Be appropriate for {level} level
+- Include topics about: {interests_text}
+- Be 150-250 words long
+- Use simple, clear language
+- Include some dialogue
+- Be engaging and educational
+
+Return ONLY valid JSON (no markdown, no code blocks) with this exact format:
+{{
+    "title": "story title in {target_language}",
+    "content": "the full story text",
+    "difficulty": "{level}",
+    "vocabulary_count": 50
+}}
+"""
+
+    response = await llm_service.chat_completion(
+        "story",
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": "You are a language learning assistant. Return ONLY valid JSON, no markdown formatting."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+        max_tokens=1000
+    )
+
+    story_text = response.choices[0].message.content.strip()
+
+    # Remove markdown code blocks if present
+    if story_text.startswith("```"):
+        story_text = story_text.split("```")[1]
+        if story_text.startswith("json"):
+            story_text = story_text[4:]
+        story_text = story_text.strip()
+
+    # Parse JSON
+    try:
+        story_data = json.loads(story_text)
+    except json.JSONDecodeError:
+        # Fallback if JSON parsing fails
+        story_data = {
+            "title": f"Learning {target_language}",
+            "content": story_text,
+            "difficulty": level,
+            "vocabulary_count": 50
+        }
+
+    return story_data
+
+# Pre-generated stories, topped up in the background whenever a bucket runs low
+story_pool = StoryPool(
+    generate_story_live,
+    low_watermark=int(os.getenv("STORY_POOL_LOW_WATERMARK", "3")),
+    target_size=int(os.getenv("STORY_POOL_TARGET_SIZE", "8")),
+    max_serves=int(os.getenv("STORY_POOL_MAX_SERVES", "20")),
+    max_buckets=int(os.getenv("STORY_POOL_MAX_BUCKETS", "256"))
+)
+
 @app.post("/api/stories/generate")
 async def generate_story(request: StoryRequest):
     """Generate a personalized language learning story"""
     try:
-        interests_text = ", ".join(request.interests) if request.interests else "general topics"
-
         # Check if OpenAI API key is available
         if not openai.api_key or openai.api_key == "":
             # Fallback: Return a sample story
@@ -398,63 +578,36 @@ async def generate_story(request: StoryRequest):
                 "message": "Using demo story. Configure OPENAI_API_KEY for AI-generated content."
             })
 
-        prompt = f"""Create a short story in {request.target_language} for a {request.level} level learner.
-
-The story should:
-- Be appropriate for {request.level} level
-- Include topics about: {interests_text}
-- Be 150-250 words long
-- Use simple, clear language
-- Include some dialogue
-- Be engaging and educational
-
-Return ONLY valid JSON (no markdown, no code blocks) with this exact format:
-{{
-    "title": "story title in {request.target_language}",
-    "content": "the full story text",
-    "difficulty": "{request.level}",
-    "vocabulary_count": 50
-}}
-"""
-
-        client = openai.OpenAI(api_key=openai.api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a language learning assistant. Return ONLY valid JSON, no markdown formatting."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-
-        story_text = response.choices[0].message.content.strip()
-
-        # Remove markdown code blocks if present
-        if story_text.startswith("```"):
-            story_text = story_text.split("```")[1]
-            if story_text.startswith("json"):
-                story_text = story_text[4:]
-            story_text = story_text.strip()
+        # Serve a pre-generated story when the bucket has one this user hasn't read
+        story_data = story_pool.take(request.target_language, request.level, request.interests, request.user_id)
+        pooled = story_data is not None
 
-        # Parse JSON
-        import json
-        try:
-            story_data = json.loads(story_text)
-        except json.JSONDecodeError:
-            # Fallback if JSON parsing fails
-            story_data = {
-                "title": f"Learning {request.target_language}",
-                "content": story_text,
-                "difficulty": request.level,
-                "vocabulary_count": 50
-            }
+        if not pooled:
+            async def generate_and_pool():
+                # Written for the bucket's topic, so the story can be pooled for its other learners
+                story = await generate_story_live(
+                    request.target_language, request.level, bucket_interests(request.interests)
+                )
+                return story_pool.add(request.target_language, request.level, request.interests, story), story
+
+            story_id, story_data = await story_flight.do(
+                story_flight.key(*bucket_key(request.target_language, request.level, request.interests)),
+                generate_and_pool
+            )
+            if not story_pool.mark_seen(story_id, request.user_id):
+                # Another request of this user's joined the same generation and already got this story
+                story_id, story_data = await generate_and_pool()
+                story_pool.mark_seen(story_id, request.user_id)
+            story_data = dict(story_data)
 
         return JSONResponse(content={
             "success": True,
-            "story": story_data
+            "story": story_data,
+            "pooled": pooled
         })
 
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Story generation timed out")
     except Exception as e:
         print(f"Story generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating story: {str(e)}")
@@ -463,6 +616,15 @@ Return ONLY valid JSON (no markdown, no code blocks) with this exact format:
 async def explain_word(request: WordExplanation):
     """Explain a word in context"""
     try:
+        cache_key = make_key(request.word, request.context, request.target_language, request.native_language)
+        cached = await explain_cache.get(cache_key)
+        if cached is not None:
+            return JSONResponse(content={
+                "success": True,
+                "explanation": cached,
+                "cached": True
+            })
+
         prompt = f"""Explain this word from {request.target_language}:
 
 Word: {request.word}
@@ -487,32 +649,41 @@ Return as JSON:
 }}
 """
 
-        client = openai.OpenAI(api_key=openai.api_key)
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a language learning tutor."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=500
+        async def fetch_explanation():
+            response = await llm_service.chat_completion(
+                "explain",
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "You are a language learning tutor."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=500
+            )
+
+            explanation = response.choices[0].message.content
+            await explain_cache.set(cache_key, explanation)
+            return explanation
+
+        explanation = await explain_flight.do(
+            explain_flight.key(request.word, request.context, request.target_language, request.native_language),
+            fetch_explanation
         )
 
-        explanation = response.choices[0].message.content
-
         return JSONResponse(content={
             "success": True,
-            "explanation": explanation
+            "explanation": explanation,
+            "cached": False
         })
 
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Word explanation timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error explaining word: {str(e)}")
 
-@app.post("/api/practice/chat")
-async def practice_conversation(request: ChatMessage):
-    """Practice conversation in target language"""
-    try:
-        system_message = f"""You are a friendly language learning tutor helping a student practice {request.target_language}.
+def build_practice_messages(request: ChatMessage):
+    """Build the tutor prompt plus conversation history for a practice turn"""
+    system_message = f"""You are a friendly language learning tutor helping a student practice {request.target_language}.
 
 Guidelines:
 - Respond naturally in {request.target_language}
@@ -522,12 +693,19 @@ Guidelines:
 - Be encouraging and supportive
 """
 
-        messages = [{"role": "system", "content": system_message}]
-        messages.extend(request.conversation_history)
-        messages.append({"role": "user", "content": request.message})
+    messages = [{"role": "system", "content": system_message}]
+    messages.extend(request.conversation_history)
+    messages.append({"role": "user", "content": request.message})
+    return messages
 
-        client = openai.OpenAI(api_key=openai.api_key)
-        response = client.chat.completions.create(
+@app.post("/api/practice/chat")
+async def practice_conversation(request: ChatMessage):
+    """Practice conversation in target language"""
+    try:
+        messages = build_practice_messages(request)
+
+        response = await llm_service.chat_completion(
+            "chat",
             model="gpt-4o-mini",
             messages=messages,
             temperature=0.8,
@@ -542,9 +720,46 @@ Guidelines:
             "timestamp": datetime.utcnow().isoformat()
         })
 
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Conversation reply timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in conversation: {str(e)}")
 
+@app.post("/api/practice/chat/stream")
+async def practice_conversation_stream(request: ChatMessage):
+    """Practice conversation, streaming the reply as NDJSON token events"""
+    messages = build_practice_messages(request)
+
+    async def events():
+        parts = []
+        try:
+            async for token in llm_service.stream_chat_completion(
+                "chat",
+                model="gpt-4o-mini",
+                messages=messages,
+                temperature=0.8,
+                max_tokens=200
+            ):
+                parts.append(token)
+                yield json.dumps({"type": "token", "content": token}) + "\n"
+
+            yield json.dumps({
+                "type": "done",
+                "success": True,
+                "message": "".join(parts),
+                "timestamp": datetime.utcnow().isoformat()
+            }) + "\n"
+        except asyncio.TimeoutError:
+            yield json.dumps({"type": "error", "detail": "Conversation reply timed out"}) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "detail": f"Error in conversation: {str(e)}"}) + "\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/languages")
 async def get_languages():
     """Get list of supported languages"""
@@ -564,35 +779,81 @@ async def get_languages():
 
 # ==================== LESSON ENDPOINTS ====================
 
+LESSON_FIELDS = ("id", "level", "title", "story", "vocabulary", "grammar", "quiz")
+LESSON_SUMMARY_FIELDS = ("id", "level", "title")
+
+def build_lesson_payloads(catalog, fields=None):
+    """Serialize every lesson response once, with ETags and compressed variants"""
+    def project(lesson):
+        return thaw(lesson) if fields is None else {field: thaw(lesson[field]) for field in fields if field in lesson}
+
+    def lesson_list(lessons):
+        return PreparedPayload.json({"success": True, "lessons": [project(lesson) for lesson in lessons], "total": len(lessons)})
+
+    return {
+        "all": lesson_list(catalog.lessons),
+        "by_level": {level: lesson_list(lessons) for level, lessons in catalog.by_level.items()},
+        "empty": lesson_list(()),
+        "by_id": {
+            lesson_id: PreparedPayload.json({"success": True, "lesson": project(lesson)})
+            for lesson_id, lesson in catalog.by_id.items()
+        }
+    }
+
+# The curriculum is static, so lesson responses are prebuilt bytes, one set per field projection
+lesson_payloads = {
+    None: build_lesson_payloads(LESSON_CATALOG),
+    LESSON_SUMMARY_FIELDS: build_lesson_payloads(LESSON_CATALOG, LESSON_SUMMARY_FIELDS)
+}
+
+# Quizzes compiled once: question lookup and normalized accepted answers are precomputed
+GRADING_ENGINE = GradingEngine(LESSON_CATALOG)
+QUIZ_BATCH_MAX_SUBMISSIONS = int(os.getenv("QUIZ_BATCH_MAX_SUBMISSIONS", "100"))
+
+def get_lesson_payloads(fields: Optional[str] = None, summary: bool = False):
+    """Prebuilt payloads for a projection; other field sets are built once on first use"""
+    if summary:
+        key = LESSON_SUMMARY_FIELDS
+    elif fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - set(LESSON_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown lesson fields: {', '.join(sorted(unknown))}")
+        requested.add("id")
+        key = tuple(field for field in LESSON_FIELDS if field in requested)
+    else:
+        key = None
+
+    payloads = lesson_payloads.get(key)
+    if payloads is None:
+        payloads = lesson_payloads[key] = build_lesson_payloads(LESSON_CATALOG, key)
+    return payloads
+
 @app.get("/api/lessons")
-async def get_lessons(level: Optional[str] = None):
-    """Get all lessons or filter by level"""
+async def get_lessons(request: Request, level: Optional[str] = None, fields: Optional[str] = None, summary: bool = False):
+    """Get all lessons or filter by level; summary/fields trim each lesson to the listed fields"""
     try:
+        payloads = get_lesson_payloads(fields, summary)
         if level:
-            lessons = get_lessons_by_level(level)
+            payload = payloads["by_level"].get(level, payloads["empty"])
         else:
-            lessons = get_all_lessons()
+            payload = payloads["all"]
 
-        return {
-            "success": True,
-            "lessons": lessons,
-            "total": len(lessons)
-        }
+        return payload.respond(request)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching lessons: {str(e)}")
 
 @app.get("/api/lessons/{lesson_id}")
-async def get_lesson(lesson_id: int):
+async def get_lesson(lesson_id: int, request: Request, fields: Optional[str] = None, summary: bool = False):
     """Get a specific lesson by ID"""
     try:
-        lesson = get_lesson_by_id(lesson_id)
-        if not lesson:
+        payload = get_lesson_payloads(fields, summary)["by_id"].get(lesson_id)
+        if not payload:
             raise HTTPException(status_code=404, detail="Lesson not found")
 
-        return {
-            "success": True,
-            "lesson": lesson
-        }
+        return payload.respond(request)
     except HTTPException:
         raise
     except Exception as e:
@@ -604,23 +865,25 @@ async def update_lesson_progress(progress: LessonProgress, request: Request):
     try:
         # Get user from token (for now, using email from request)
         # In production, extract from JWT token
-        user_email = request.headers.get("X-User-Email", "guest@example.com")
-
-        if user_email not in user_lesson_progress:
-            user_lesson_progress[user_email] = {}
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
 
-        user_lesson_progress[user_email][progress.lesson_id] = {
-            "lesson_id": progress.lesson_id,
-            "completed": progress.completed,
-            "score": progress.score,
-            "attempts": progress.attempts,
-            "last_attempt": datetime.utcnow().isoformat()
-        }
+        try:
+            saved = await storage.save_lesson_progress(user_email, {
+                "lesson_id": progress.lesson_id,
+                "completed": progress.completed,
+                "score": progress.score,
+                "attempts": progress.attempts,
+                "last_attempt": datetime.utcnow().isoformat()
+            })
+        except UnknownUserError:
+            raise HTTPException(status_code=404, detail="User not found")
 
         return {
             "success": True,
-            "progress": user_lesson_progress[user_email][progress.lesson_id]
+            "progress": saved
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating progress: {str(e)}")
 
@@ -628,9 +891,9 @@ async def update_lesson_progress(progress: LessonProgress, request: Request):
 async def get_all_progress(request: Request):
     """Get all lesson progress for current user"""
     try:
-        user_email = request.headers.get("X-User-Email", "guest@example.com")
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
 
-        progress = user_lesson_progress.get(user_email, {})
+        progress = await storage.get_lesson_progress(user_email)
 
         return {
             "success": True,
@@ -641,6 +904,34 @@ async def get_all_progress(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching progress: {str(e)}")
 
+async def record_quiz_attempt(user_email, lesson_progress, lesson_id, result, answers, completed_at=None):
+    """Store a graded attempt in the user's lesson progress; returns the XP it earns"""
+    attempts = lesson_progress.get(lesson_id, {}).get("attempts", 0) + 1
+    progress = {
+        "lesson_id": lesson_id,
+        "completed": result["passed"],
+        "score": result["score"],
+        "attempts": attempts,
+        "last_attempt": completed_at or datetime.utcnow().isoformat()
+    }
+
+    # Calculate XP earned
+    xp_earned = 0
+    if result["passed"]:
+        xp_earned = 50  # Base XP for passing
+        if result["score"] == 100:
+            xp_earned += 25  # Bonus for perfect score
+        if attempts == 1:
+            xp_earned += 25  # Bonus for first attempt
+
+    try:
+        lesson_progress[lesson_id] = await storage.save_lesson_progress(
+            user_email, progress, attempt={"answers": answers, "xp_earned": xp_earned}
+        )
+    except UnknownUserError:
+        raise HTTPException(status_code=404, detail="User not found")
+    return xp_earned
+
 @app.post("/api/lessons/{lesson_id}/quiz")
 async def submit_quiz(lesson_id: int, submission: QuizSubmission, request: Request):
     """Submit quiz answers and get score"""
@@ -649,83 +940,107 @@ async def submit_quiz(lesson_id: int, submission: QuizSubmission, request: Reque
         if not lesson:
             raise HTTPException(status_code=404, detail="Lesson not found")
 
-        quiz = lesson.get("quiz", [])
-        if not quiz:
+        quiz = GRADING_ENGINE.get(lesson_id)
+        if quiz is None:
             raise HTTPException(status_code=400, detail="No quiz for this lesson")
 
         # Grade the quiz
-        total_questions = len(quiz)
-        correct_answers = 0
-        detailed_results = []
-
-        for answer in submission.answers:
-            question = next((q for q in quiz if q["id"] == answer.question_id), None)
-            if question:
-                is_correct = answer.answer.strip().lower() == question["correct"].strip().lower()
-                if is_correct:
-                    correct_answers += 1
-
-                detailed_results.append({
-                    "question_id": answer.question_id,
-                    "question": question["question"],
-                    "user_answer": answer.answer,
-                    "correct_answer": question["correct"],
-                    "is_correct": is_correct
-                })
-
-        score = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
-        passed = score >= 70  # 70% to pass
-
-        # Update progress
-        user_email = request.headers.get("X-User-Email", "guest@example.com")
-        if user_email not in user_lesson_progress:
-            user_lesson_progress[user_email] = {}
-
-        current_progress = user_lesson_progress[user_email].get(lesson_id, {})
-        attempts = current_progress.get("attempts", 0) + 1
-
-        user_lesson_progress[user_email][lesson_id] = {
-            "lesson_id": lesson_id,
-            "completed": passed,
-            "score": score,
-            "attempts": attempts,
-            "last_attempt": datetime.utcnow().isoformat()
-        }
-
-        # Calculate XP earned
-        xp_earned = 0
-        if passed:
-            xp_earned = 50  # Base XP for passing
-            if score == 100:
-                xp_earned += 25  # Bonus for perfect score
-            if attempts == 1:
-                xp_earned += 25  # Bonus for first attempt
-
-            # Award XP to user
-            add_xp(user_email, xp_earned)
+        result = quiz.grade((answer.question_id, answer.answer) for answer in submission.answers)
+        score = result["score"]
+        passed = result["passed"]
+
+        # Update progress and award XP; room for the award is held first, so a 503 leaves nothing half-saved
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
+        async with reserved_xp():
+            xp_earned = await record_quiz_attempt(
+                user_email, await storage.get_lesson_progress(user_email), lesson_id, result,
+                [answer.dict() for answer in submission.answers], submission.completed_at
+            )
+            if xp_earned:
+                await add_xp(user_email, xp_earned, source="quiz")
 
         # Get updated user stats
-        user_stats = user_xp.get(user_email, {})
-        current_league = get_league_from_xp(user_stats.get('total_xp', 0))
+        user_stats = await get_user_xp(user_email) or {}
+        current_league = await get_user_league(user_email, user_stats.get('total_xp', 0))
 
         return {
             "success": True,
             "score": score,
             "passed": passed,
-            "correct_answers": correct_answers,
-            "total_questions": total_questions,
+            "correct_answers": result["correct_answers"],
+            "total_questions": result["total_questions"],
             "xp_earned": xp_earned,
             "total_xp": user_stats.get('total_xp', 0),
             "league": current_league,
             "streak_days": user_stats.get('streak_days', 0),
-            "detailed_results": detailed_results,
-            "message": "Congratulations! You passed!" if passed else "Keep trying! You need 70% to pass."
+            "detailed_results": result["detailed_results"],
+            "message": "Congratulations! You passed!" if passed else f"Keep trying! You need {PASSING_SCORE}% to pass."
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error submitting quiz: {str(e)}")
 
+@app.post("/api/lessons/quiz/batch")
+async def submit_quiz_batch(batch: QuizBatchSubmission, request: Request):
+    """Submit quizzes completed offline; XP and the leaderboard are updated once for the whole batch"""
+    try:
+        if len(batch.submissions) > QUIZ_BATCH_MAX_SUBMISSIONS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {QUIZ_BATCH_MAX_SUBMISSIONS} submissions per batch"
+            )
+
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
+        graded = GRADING_ENGINE.grade_batch(
+            (submission.lesson_id, [(answer.question_id, answer.answer) for answer in submission.answers])
+            for submission in batch.submissions
+        )
+
+        # Progress is recorded in submission order so attempt counts and bonuses match one-by-one syncing.
+        # Room for the award is held first, so a 503 leaves no attempts recorded
+        async with reserved_xp():
+            lesson_progress = await storage.get_lesson_progress(user_email)
+            results = []
+            total_xp_earned = 0
+            for submission, result in zip(batch.submissions, graded):
+                if result is None:
+                    error = "Lesson not found" if get_lesson_by_id(submission.lesson_id) is None else "No quiz for this lesson"
+                    results.append({"lesson_id": submission.lesson_id, "success": False, "error": error})
+                    continue
+
+                xp_earned = await record_quiz_attempt(
+                    user_email, lesson_progress, submission.lesson_id, result,
+                    [answer.dict() for answer in submission.answers], submission.completed_at
+                )
+                total_xp_earned += xp_earned
+                results.append({
+                    "lesson_id": submission.lesson_id,
+                    "success": True,
+                    **result,
+                    "xp_earned": xp_earned
+                })
+
+            # One XP update, so the user is re-ranked once per batch
+            if total_xp_earned:
+                await add_xp(user_email, total_xp_earned, source="quiz")
+
+        user_stats = await get_user_xp(user_email) or {}
+
+        return {
+            "success": True,
+            "results": results,
+            "graded": sum(1 for result in results if result["success"]),
+            "xp_earned": total_xp_earned,
+            "total_xp": user_stats.get('total_xp', 0),
+            "league": await get_user_league(user_email, user_stats.get('total_xp', 0)),
+            "streak_days": user_stats.get('streak_days', 0)
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error submitting quiz batch: {str(e)}")
+
 @app.post("/api/auth/apple")
 async def apple_auth(request: Request):
     """Handle Apple Sign In authentication"""
@@ -748,16 +1063,12 @@ async def apple_auth(request: Request):
         # For now, we'll create/login the user
 
         # Try to find existing user by Apple user_id
-        existing_user = None
-        for user_email, user_data in users.items():
-            if user_data.get('oauth_provider') == 'apple' and user_data.get('oauth_id') == user_id:
-                existing_user = user_email
-                break
+        existing_user = await storage.find_oauth_user('apple', user_id)
 
         if existing_user:
             # Returning user - load their data
-            print(f"Found existing Apple user: {existing_user}")
-            user_data = users[existing_user].copy()
+            print(f"Found existing Apple user: {existing_user['email']}")
+            user_data = existing_user.copy()
         else:
             # New user - create account
             print(f"Creating new Apple user: user_id={user_id}")
@@ -775,12 +1086,11 @@ async def apple_auth(request: Request):
             # Ensure username is unique
             username = base_username
             counter = 1
-            while username in usernames:
+            while await storage.username_exists(username):
                 username = f"{base_username}{counter}"
                 counter += 1
 
             # Create new user
-            usernames.add(username)
             user_email = email or f"{user_id}@privaterelay.appleid.com"
 
             user_data = {
@@ -794,8 +1104,8 @@ async def apple_auth(request: Request):
                 'oauth_id': user_id
             }
 
-            # Store by email AND by Apple user_id for future lookups
-            users[user_email] = user_data
+            # Stored by email and indexed by Apple user_id for future lookups
+            user_data = (await storage.create_user(user_data)).copy()
             print(f"Created new user: {user_email} (username: {username})")
 
         # Remove sensitive data
@@ -839,17 +1149,17 @@ async def get_leagues_info():
 async def get_leaderboard(limit: int = 50):
     """Get weekly leaderboard"""
     try:
-        # Update leaderboard first
-        update_leaderboard()
+        board = await current_leaderboard()
 
         # Return top N users
-        top_users = weekly_leaderboard[:limit]
+        top_users = await board.top(limit)
 
         return {
             "success": True,
             "leaderboard": top_users,
-            "total_users": len(weekly_leaderboard),
-            "week_number": current_week
+            "total_users": await board.count(),
+            "week_number": current_week[1],
+            "week_year": current_week[0]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching leaderboard: {str(e)}")
@@ -858,41 +1168,33 @@ async def get_leaderboard(limit: int = 50):
 async def get_my_league_stats(request: Request):
     """Get current user's league stats and ranking"""
     try:
-        user_email = request.headers.get("X-User-Email", "guest@example.com")
-
-        # Update leaderboard
-        update_leaderboard()
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
 
         # Get user stats
-        stats = user_xp.get(user_email, {
+        stats = await get_user_xp(user_email) or {
             'total_xp': 0,
             'weekly_xp': 0,
             'streak_days': 0,
-            'last_active': datetime.datetime.utcnow().isoformat()
-        })
+            'last_active': datetime.utcnow().isoformat()
+        }
 
         # Determine league
-        league_id = get_league_from_xp(stats['total_xp'])
+        league_id = await get_user_league(user_email, stats['total_xp'])
         league_info = LEAGUES[league_id]
 
         # Find user's rank
-        rank = None
-        for i, user in enumerate(weekly_leaderboard):
-            if user['email'] == user_email:
-                rank = i + 1
-                break
+        board = await current_leaderboard()
+        rank = await board.rank(user_email)
+        league_board = board.partition(league_id)
 
-        # Get XP needed for next league
+        # Get XP needed for next league, counting from the league the user is placed in
         next_league_xp = None
         next_league_name = None
-        league_keys = list(LEAGUES.keys())
-        current_league_index = league_keys.index(league_id)
+        next_league = LEAGUE_TABLE.next_league(stats['total_xp'], league_id)
 
-        if current_league_index < len(league_keys) - 1:
-            next_league_id = league_keys[current_league_index + 1]
-            next_league_info = LEAGUES[next_league_id]
-            next_league_xp = next_league_info['min_xp'] - stats['total_xp']
-            next_league_name = next_league_info['name']
+        if next_league:
+            next_league_id, next_league_xp = next_league
+            next_league_name = LEAGUES[next_league_id]['name']
 
         return {
             "success": True,
@@ -902,7 +1204,9 @@ async def get_my_league_stats(request: Request):
             "league": league_info,
             "league_id": league_id,
             "rank": rank,
-            "total_competitors": len(weekly_leaderboard),
+            "total_competitors": await board.count(),
+            "league_rank": await league_board.rank(user_email),
+            "league_competitors": await league_board.count(),
             "next_league": {
                 "name": next_league_name,
                 "xp_needed": next_league_xp
@@ -911,6 +1215,26 @@ async def get_my_league_stats(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
 
+@app.get("/api/leagues/around-me")
+async def get_leaderboard_around_me(request: Request, radius: int = 5):
+    """Get the slice of the weekly leaderboard surrounding the current user"""
+    try:
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
+        radius = min(max(radius, 0), 50)
+        await get_user_xp(user_email)
+        board = await current_leaderboard()
+
+        return {
+            "success": True,
+            "rank": await board.rank(user_email),
+            "leaderboard": await board.around(user_email, radius),
+            "total_competitors": await board.count(),
+            "week_number": current_week[1],
+            "week_year": current_week[0]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching leaderboard: {str(e)}")
+
 @app.get("/api/leagues/by-league/{league_id}")
 async def get_league_leaderboard(league_id: str, limit: int = 20):
     """Get leaderboard filtered by specific league"""
@@ -918,24 +1242,49 @@ async def get_league_leaderboard(league_id: str, limit: int = 20):
         if league_id not in LEAGUES:
             raise HTTPException(status_code=404, detail="League not found")
 
-        # Update leaderboard
-        update_leaderboard()
-
-        # Filter by league
-        league_users = [user for user in weekly_leaderboard if user['league'] == league_id]
-        league_users = league_users[:limit]
+        league_board = (await current_leaderboard()).partition(league_id)
+        league_users = await league_board.top(limit)
 
         return {
             "success": True,
             "league": LEAGUES[league_id],
             "leaderboard": league_users,
-            "total_users": len(league_users)
+            "total_users": await league_board.count()
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching league leaderboard: {str(e)}")
 
+@app.get("/api/leagues/history")
+async def get_leaderboard_history():
+    """List the archived weekly leaderboards"""
+    weeks = await storage.leaderboard_weeks(roll_week())
+
+    return {
+        "success": True,
+        "weeks": [
+            {"week_year": year, "week_number": week, "total_users": await (await storage.leaderboard((year, week))).count()}
+            for year, week in weeks
+        ]
+    }
+
+@app.get("/api/leagues/history/{week_year}/{week_number}")
+async def get_archived_leaderboard(week_year: int, week_number: int, limit: int = 50):
+    """Get the final standings of a finished week"""
+    week = (week_year, week_number)
+    board = await storage.leaderboard(week) if week in await storage.leaderboard_weeks(roll_week()) else None
+    if board is None:
+        raise HTTPException(status_code=404, detail="No leaderboard archived for that week")
+
+    return {
+        "success": True,
+        "leaderboard": await board.top(limit),
+        "total_users": await board.count(),
+        "week_number": week_number,
+        "week_year": week_year
+    }
+
 @app.post("/api/xp/add")
 async def add_xp_manual(request: Request):
     """Manually add XP (for activities like stories, practice, etc.)"""
@@ -947,14 +1296,14 @@ async def add_xp_manual(request: Request):
         if xp_amount <= 0 or xp_amount > 100:
             raise HTTPException(status_code=400, detail="XP amount must be between 1 and 100")
 
-        user_email = request.headers.get("X-User-Email", "guest@example.com")
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
 
         # Award XP
-        add_xp(user_email, xp_amount)
+        await add_xp(user_email, xp_amount, source=activity)
 
         # Get updated stats
-        stats = user_xp.get(user_email, {})
-        league_id = get_league_from_xp(stats['total_xp'])
+        stats = await get_user_xp(user_email)
+        league_id = await get_user_league(user_email, stats['total_xp'])
 
         return {
             "success": True,
@@ -969,9 +1318,41 @@ async def add_xp_manual(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding XP: {str(e)}")
 
-# Mount static files
-if os.path.exists("static"):
-    app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.get("/api/xp/activity")
+async def get_xp_activity(request: Request, days: int = 30):
+    """XP earned per day over the last N days, oldest first, for activity charts"""
+    try:
+        user_email = request.headers.get("X-User-Email", GUEST_EMAIL)
+        days = min(max(days, 1), XP_ACTIVITY_MAX_DAYS)
+        end = datetime.utcnow().date()
+        start = end - timedelta(days=days - 1)
+        daily_xp = await storage.xp_activity(user_email, start, end)
+
+        activity = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            activity.append({"date": day.isoformat(), "xp": daily_xp.get(day, 0)})
+
+        return {
+            "success": True,
+            "activity": activity,
+            "total_xp": sum(daily_xp.values()),
+            "active_days": sum(1 for xp in daily_xp.values() if xp)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching XP activity: {str(e)}")
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def static_files(path: str, request: Request):
+    """Serve a static file from the in-memory cache, or from disk if it is too large to cache"""
+    payload = static_cache.get(path)
+    if payload is not None:
+        return payload.respond(request)
+    if not static_cache.is_on_disk(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    response = await static_disk.get_response(path, request.scope)
+    response.headers["Cache-Control"] = static_cache.cache_control(path)
+    return response
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,12 @@
+"""
+pytest configuration
+Being at the app root puts this directory on sys.path, so tests import services, database and lessons_data directly
+"""
+
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    """Async tests (pytest.mark.anyio) run on asyncio, like the app"""
+    return "asyncio"
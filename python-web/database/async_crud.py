@@ -0,0 +1,341 @@
+"""
+Async CRUD operations for database
+Same operations as crud.py for AsyncSession, so queries never block the event loop
+"""
+
+import asyncio
+from concurrent.futures import Executor
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.crud import bulk_user_rows, first_free_username, insert_ignoring_duplicates, get_password_hash, mirror_league_placements, upsert_insert, username_candidates_clause, xp_aggregate_upserts
+from database.models import User, UserSettings, UserProgress, QuizAttempt, League, LeagueParticipant, XPTransaction, XPLedgerCheckpoint, XPDaily, XPWeekly
+
+
+# User CRUD operations
+async def get_user_by_email(db: AsyncSession, email: str):
+    """Get user by email"""
+    return await db.scalar(select(User).where(User.email == email).limit(1))
+
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    """Get user by username"""
+    return await db.scalar(select(User).where(User.username == username).limit(1))
+
+
+async def get_user_by_oauth(db: AsyncSession, oauth_provider: str, oauth_id: str):
+    """Get user by OAuth provider and ID"""
+    return await db.scalar(select(User).where(
+        User.oauth_provider == oauth_provider,
+        User.oauth_id == oauth_id
+    ).limit(1))
+
+
+async def create_user(
+    db: AsyncSession,
+    email: str,
+    username: str,
+    target_language: str,
+    password: str = None,
+    oauth_provider: str = None,
+    oauth_id: str = None,
+    profile_image_url: str = None,
+    native_language: str = "English",
+    assessed_level: str = None,
+    interests: list = None
+):
+    """Create a new user"""
+    # bcrypt is deliberately slow, so hash off the event loop
+    password_hash = await asyncio.to_thread(get_password_hash, password) if password else None
+
+    db_user = User(
+        email=email,
+        username=username,
+        password_hash=password_hash,
+        oauth_provider=oauth_provider,
+        oauth_id=oauth_id,
+        target_language=target_language,
+        native_language=native_language,
+        assessed_level=assessed_level,
+        interests=interests,
+        profile_image_url=profile_image_url,
+        last_login=datetime.utcnow()
+    )
+    db.add(db_user)
+    await db.flush()  # Assigns db_user.id without ending the transaction
+
+    # Settings and progress commit together with the user
+    db.add_all([
+        UserSettings(user_id=db_user.id),
+        UserProgress(user_id=db_user.id)
+    ])
+    await db.commit()
+    return db_user
+
+
+async def bulk_create_users(db: AsyncSession, users, batch_size: int = 1000, executor: Optional[Executor] = None) -> int:
+    """Provision many users with their settings and progress; returns how many were created"""
+    dialect_name = db.get_bind().dialect.name
+    created = 0
+    batch = []
+
+    async def flush_batch():
+        rows = await asyncio.to_thread(bulk_user_rows, batch, executor)
+        user_ids = list(await db.scalars(
+            insert_ignoring_duplicates(dialect_name, User).returning(User.id),
+            rows
+        ))
+        if user_ids:
+            await db.execute(insert(UserSettings), [{"user_id": user_id} for user_id in user_ids])
+            await db.execute(insert(UserProgress), [{"user_id": user_id} for user_id in user_ids])
+        await db.commit()
+        batch.clear()
+        return len(user_ids)
+
+    for user in users:
+        batch.append(user)
+        if len(batch) >= batch_size:
+            created += await flush_batch()
+    if batch:
+        created += await flush_batch()
+    return created
+
+
+async def update_user_login(db: AsyncSession, user_id: int):
+    """Update user's last login timestamp"""
+    await db.execute(update(User).where(User.id == user_id).values(last_login=datetime.utcnow()))
+    await db.commit()
+
+
+async def username_exists(db: AsyncSession, username: str) -> bool:
+    """Check if username is already taken"""
+    return await db.scalar(select(User.id).where(User.username == username).limit(1)) is not None
+
+
+async def suggest_username(db: AsyncSession, base_username: str) -> str:
+    """Suggest an available username"""
+    # One query for the base name and its numbered variants
+    taken = set(await db.scalars(select(User.username).where(username_candidates_clause(base_username))))
+    return first_free_username(base_username, taken)
+
+
+# User Settings CRUD
+async def get_user_settings(db: AsyncSession, user_id: int):
+    """Get user settings"""
+    return await db.scalar(select(UserSettings).where(UserSettings.user_id == user_id))
+
+
+async def update_user_settings(db: AsyncSession, user_id: int, **kwargs):
+    """Update user settings"""
+    await db.execute(update(UserSettings).where(UserSettings.user_id == user_id).values(**kwargs))
+    await db.commit()
+    return await get_user_settings(db, user_id)
+
+
+# User Progress CRUD
+async def get_user_progress(db: AsyncSession, user_id: int):
+    """Get user progress"""
+    return await db.scalar(select(UserProgress).where(UserProgress.user_id == user_id))
+
+
+async def update_user_progress(db: AsyncSession, user_id: int, commit: bool = True, **kwargs):
+    """Update user progress"""
+    await db.execute(update(UserProgress).where(UserProgress.user_id == user_id).values(**kwargs))
+    if commit:
+        await db.commit()
+    return await get_user_progress(db, user_id)
+
+
+async def add_xp(db: AsyncSession, user_id: int, amount: int, source: str, source_id: int = None, description: str = None):
+    """Add XP to user's total and log the transaction atomically; returns the new total"""
+    total_xp = (await db.execute(
+        update(UserProgress)
+        .where(UserProgress.user_id == user_id)
+        .values(total_xp=func.coalesce(UserProgress.total_xp, 0) + amount)
+        .returning(UserProgress.total_xp)
+        .execution_options(synchronize_session=False)
+    )).scalar_one_or_none()
+    if total_xp is None:
+        await db.rollback()
+        raise ValueError(f"No progress row for user {user_id}")
+
+    created_at = datetime.utcnow()
+    await db.execute(insert(XPTransaction).values(
+        user_id=user_id,
+        amount=amount,
+        source=source,
+        source_id=source_id,
+        description=description,
+        created_at=created_at
+    ))
+    for statement, rows in xp_aggregate_upserts(db.get_bind().dialect.name, [(user_id, created_at, amount)]):
+        await db.execute(statement, rows)
+    await db.commit()
+
+    return total_xp
+
+
+async def add_xp_batch(db: AsyncSession, awards, batch_size: int = 500, commit: bool = True) -> dict:
+    """Apply many XP awards in one transaction; returns {user_id: new total}"""
+    awards = list(awards)
+    totals_by_user = {}
+    for award in awards:
+        totals_by_user[award["user_id"]] = totals_by_user.get(award["user_id"], 0) + award["amount"]
+
+    now = datetime.utcnow()
+    new_totals = {}
+    user_ids = list(totals_by_user)
+    for start in range(0, len(user_ids), batch_size):
+        chunk = {user_id: totals_by_user[user_id] for user_id in user_ids[start:start + batch_size]}
+        rows = await db.execute(
+            update(UserProgress)
+            .where(UserProgress.user_id.in_(chunk))
+            .values(total_xp=func.coalesce(UserProgress.total_xp, 0) + case(chunk, value=UserProgress.user_id, else_=0))
+            .returning(UserProgress.user_id, UserProgress.total_xp)
+            .execution_options(synchronize_session=False)
+        )
+        new_totals.update(rows.all())
+
+    ledger = [{
+        "user_id": award["user_id"],
+        "amount": award["amount"],
+        "source": award["source"],
+        "source_id": award.get("source_id"),
+        "description": award.get("description"),
+        "created_at": award.get("created_at") or now
+    } for award in awards if award["user_id"] in new_totals]
+    if ledger:
+        await db.execute(insert(XPTransaction), ledger)
+        increments = [(row["user_id"], row["created_at"], row["amount"]) for row in ledger]
+        for statement, rows in xp_aggregate_upserts(db.get_bind().dialect.name, increments):
+            await db.execute(statement, rows)
+    if commit:
+        await db.commit()
+    return new_totals
+
+
+async def get_xp_ledger_checkpoint(db: AsyncSession, journal: str) -> int:
+    """Last journal sequence number written by a write-behind XP buffer"""
+    checkpoint = await db.get(XPLedgerCheckpoint, journal)
+    return checkpoint.last_seq if checkpoint is not None else 0
+
+
+async def write_xp_ledger_batch(db: AsyncSession, awards, journal: str = None, last_seq: int = None) -> dict:
+    """Apply buffered XP awards and advance the journal checkpoint in one transaction"""
+    new_totals = await add_xp_batch(db, awards, commit=False)
+    if journal is not None:
+        await db.merge(XPLedgerCheckpoint(journal=journal, last_seq=last_seq))
+    await db.commit()
+    return new_totals
+
+
+async def get_weekly_xp(db: AsyncSession, user_id: int, week_start: date) -> int:
+    """XP a user earned in the ISO week starting on week_start"""
+    return await db.scalar(select(XPWeekly.xp).where(
+        XPWeekly.user_id == user_id,
+        XPWeekly.week_start == week_start
+    )) or 0
+
+
+async def get_daily_xp(db: AsyncSession, user_id: int, start: date, end: date) -> dict:
+    """{day: XP} for the days between start and end (inclusive) with any XP"""
+    result = await db.execute(select(XPDaily.day, XPDaily.xp).where(
+        XPDaily.user_id == user_id,
+        XPDaily.day.between(start, end)
+    ))
+    return dict(result.all())
+
+
+# Quiz attempt CRUD
+async def create_quiz_attempt(
+    db: AsyncSession,
+    user_id: int,
+    lesson_id: int,
+    score: int,
+    answers: list = None,
+    xp_earned: int = None,
+    completed_at: datetime = None,
+    commit: bool = True
+):
+    """Record a graded quiz attempt"""
+    attempt = QuizAttempt(
+        user_id=user_id,
+        lesson_id=lesson_id,
+        score=score,
+        perfect_score=score == 100,
+        answers=answers,
+        xp_earned=xp_earned,
+        completed_at=completed_at or datetime.utcnow()
+    )
+    db.add(attempt)
+    if commit:
+        await db.commit()
+    return attempt
+
+
+async def get_quiz_attempts(db: AsyncSession, user_id: int):
+    """Get a user's quiz attempts, oldest first"""
+    result = await db.scalars(select(QuizAttempt).where(
+        QuizAttempt.user_id == user_id
+    ).order_by(QuizAttempt.completed_at, QuizAttempt.id))
+    return result.all()
+
+
+# League CRUD
+async def get_league_by_name(db: AsyncSession, name: str):
+    """Get league by name"""
+    return await db.scalar(select(League).where(League.name == name))
+
+
+async def upsert_league_participant(
+    db: AsyncSession,
+    user_id: int,
+    league_id: int,
+    week_start,
+    week_end,
+    weekly_xp: int,
+    league_order: dict = None
+):
+    """Record a user's weekly XP in their league cohort, moving them if their league changed.
+
+    One INSERT ... ON CONFLICT, so workers recording the same user's first
+    award of a week can't collide on idx_user_week. With league_order
+    ({league id: rank_order}) a user is only ever moved up, so a placement
+    from the weekly promotion job holds for the week. The placement is
+    copied onto the user's xp_weekly row, which leaderboards rank on.
+    """
+    statement = upsert_insert(db.get_bind().dialect.name, LeagueParticipant).values(
+        user_id=user_id,
+        league_id=league_id,
+        week_start=week_start,
+        week_end=week_end,
+        weekly_xp=weekly_xp
+    )
+    new_league_id = statement.excluded.league_id
+    if league_order is not None:
+        new_league_id = case(
+            (case(league_order, value=statement.excluded.league_id) > case(league_order, value=LeagueParticipant.league_id),
+             statement.excluded.league_id),
+            else_=LeagueParticipant.league_id
+        )
+    participant = await db.scalar(statement.on_conflict_do_update(
+        index_elements=["user_id", "week_start"],
+        set_={"league_id": new_league_id, "weekly_xp": statement.excluded.weekly_xp}
+    ).returning(LeagueParticipant), execution_options={"populate_existing": True})
+    await db.execute(mirror_league_placements(
+        db.get_bind().dialect.name,
+        LeagueParticipant.user_id == user_id,
+        LeagueParticipant.week_start == week_start
+    ))
+    await db.commit()
+    return participant
+
+
+async def get_latest_league_participant(db: AsyncSession, user_id: int):
+    """Get a user's most recent weekly league entry"""
+    return await db.scalar(select(LeagueParticipant).where(
+        LeagueParticipant.user_id == user_id
+    ).order_by(LeagueParticipant.week_start.desc()).limit(1))
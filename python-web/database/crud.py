@@ -2,10 +2,14 @@
 CRUD operations for database
 """
 
+from sqlalchemy import and_, case, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from database.models import User, UserSettings, UserProgress
+from database.models import User, UserSettings, UserProgress, QuizAttempt, League, LeagueParticipant, XPTransaction, XPLedgerCheckpoint, XPDaily, XPWeekly
 from passlib.context import CryptContext
-from datetime import datetime
+from concurrent.futures import Executor
+from datetime import date, datetime, timedelta
+from typing import Optional
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -48,7 +52,10 @@ def create_user(
     password: str = None,
     oauth_provider: str = None,
     oauth_id: str = None,
-    profile_image_url: str = None
+    profile_image_url: str = None,
+    native_language: str = "English",
+    assessed_level: str = None,
+    interests: list = None
 ):
     """Create a new user"""
     password_hash = get_password_hash(password) if password else None
@@ -60,23 +67,153 @@ def create_user(
         oauth_provider=oauth_provider,
         oauth_id=oauth_id,
         target_language=target_language,
+        native_language=native_language,
+        assessed_level=assessed_level,
+        interests=interests,
         profile_image_url=profile_image_url,
         last_login=datetime.utcnow()
     )
     db.add(db_user)
+    db.flush()  # Assigns db_user.id without ending the transaction
+
+    # Settings and progress commit together with the user
+    db.add_all([
+        UserSettings(user_id=db_user.id),
+        UserProgress(user_id=db_user.id)
+    ])
     db.commit()
-    db.refresh(db_user)
+    return db_user
 
-    # Create user settings
-    db_settings = UserSettings(user_id=db_user.id)
-    db.add(db_settings)
 
-    # Create user progress
-    db_progress = UserProgress(user_id=db_user.id)
-    db.add(db_progress)
+# Columns a bulk-provisioned user row may set
+BULK_USER_FIELDS = (
+    "email", "username", "password_hash", "oauth_provider", "oauth_id", "target_language",
+    "native_language", "assessed_level", "profile_image_url", "interests", "created_at", "last_login"
+)
+
+
+def bulk_user_row(user: dict) -> dict:
+    """Users table row for a bulk-provisioned account; plain passwords are left to bulk_user_rows()"""
+    row = {field: user[field] for field in BULK_USER_FIELDS if field in user}
+    row.setdefault("native_language", "English")
+    return row
+
+
+def bulk_user_rows(users, executor: Optional[Executor] = None) -> list:
+    """Users table rows for a batch of bulk-provisioned accounts.
+
+    Imports should carry existing hashes. bcrypt costs ~0.1s per plain
+    password, so those are hashed across executor's worker processes before
+    the batch is inserted; without an executor such rows are rejected.
+    """
+    rows = [bulk_user_row(user) for user in users]
+    plain = [(row, user["password"]) for row, user in zip(rows, users)
+             if "password_hash" not in row and user.get("password")]
+    if plain:
+        if executor is None:
+            raise ValueError(f"{len(plain)} users have a plain password but no password_hash; "
+                             "pass an executor to hash them")
+        hashes = executor.map(get_password_hash, [password for _, password in plain], chunksize=16)
+        for (row, _), password_hash in zip(plain, hashes):
+            row["password_hash"] = password_hash
+    return rows
+
+
+def insert_ignoring_duplicates(dialect_name: str, table):
+    """INSERT that skips rows whose email, username or OAuth id already exist"""
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def week_start_of(day: date) -> date:
+    """Monday of the ISO week containing a day"""
+    return day - timedelta(days=day.weekday())
+
+
+def upsert_insert(dialect_name: str, table):
+    """INSERT that can take an ON CONFLICT clause (PostgreSQL and SQLite)"""
+    dialect = {"postgresql": postgresql, "sqlite": sqlite}.get(dialect_name)
+    if dialect is None:
+        raise ValueError(f"Upserts need PostgreSQL or SQLite, not {dialect_name}")
+    return dialect.insert(table)
+
+
+def xp_aggregate_upserts(dialect_name: str, increments):
+    """(statement, rows) pairs that add XP to the per-day and per-week aggregates.
+
+    increments are (user_id, created_at, amount). Amounts are summed per row
+    first, since one ON CONFLICT statement can't update a row twice.
+    """
+    daily, weekly = {}, {}
+    for user_id, created_at, amount in increments:
+        day = created_at.date()
+        daily[(user_id, day)] = daily.get((user_id, day), 0) + amount
+        weekly[(user_id, week_start_of(day))] = weekly.get((user_id, week_start_of(day)), 0) + amount
+
+    upserts = []
+    for model, key, sums in ((XPDaily, "day", daily), (XPWeekly, "week_start", weekly)):
+        if not sums:
+            continue
+        statement = upsert_insert(dialect_name, model)
+        statement = statement.on_conflict_do_update(
+            index_elements=["user_id", key],
+            set_={"xp": model.xp + statement.excluded.xp}
+        )
+        upserts.append((statement, [{"user_id": user_id, key: value, "xp": xp} for (user_id, value), xp in sums.items()]))
+    return upserts
+
+
+def mirror_league_placements(dialect_name: str, *criteria):
+    """Upsert that copies LeagueParticipant placements matching criteria onto xp_weekly.
+
+    Boards rank on xp_weekly alone, so a placed user without XP yet gets a
+    row with xp 0; existing rows keep their XP and take the new league.
+    """
+    statement = upsert_insert(dialect_name, XPWeekly).from_select(
+        ["user_id", "week_start", "league_id", "xp"],
+        select(LeagueParticipant.user_id, LeagueParticipant.week_start, LeagueParticipant.league_id, literal(0)).where(
+            LeagueParticipant.user_id.isnot(None), *criteria  # SQLite needs a WHERE before ON CONFLICT
+        )
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["user_id", "week_start"],
+        set_={"league_id": statement.excluded.league_id}
+    )
 
-    db.commit()
-    return db_user
+
+def bulk_create_users(db: Session, users, batch_size: int = 1000, executor: Optional[Executor] = None) -> int:
+    """Provision many users with their settings and progress; returns how many were created.
+
+    Each batch is three multi-row INSERTs in one transaction. Rows that
+    collide with an existing user are skipped. Plain passwords need an
+    executor (ideally a ProcessPoolExecutor) to be hashed in; see bulk_user_rows().
+    """
+    dialect_name = db.get_bind().dialect.name
+    created = 0
+    batch = []
+
+    def flush_batch():
+        user_ids = list(db.scalars(
+            insert_ignoring_duplicates(dialect_name, User).returning(User.id),
+            bulk_user_rows(batch, executor)
+        ))
+        if user_ids:
+            db.execute(insert(UserSettings), [{"user_id": user_id} for user_id in user_ids])
+            db.execute(insert(UserProgress), [{"user_id": user_id} for user_id in user_ids])
+        db.commit()
+        batch.clear()
+        return len(user_ids)
+
+    for user in users:
+        batch.append(user)
+        if len(batch) >= batch_size:
+            created += flush_batch()
+    if batch:
+        created += flush_batch()
+    return created
 
 
 def update_user_login(db: Session, user_id: int):
@@ -92,15 +229,22 @@ def username_exists(db: Session, username: str) -> bool:
     return db.query(User).filter(User.username == username).first() is not None
 
 
-def suggest_username(db: Session, base_username: str) -> str:
-    """Suggest an available username"""
-    if not username_exists(db, base_username):
-        return base_username
+def username_candidates_clause(base_username: str):
+    """Usernames that are base_username itself or base_username plus a 1-3 character suffix"""
+    escaped = base_username.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return and_(
+        User.username.like(f"{escaped}%", escape="\\"),
+        func.length(User.username) <= len(base_username) + 3
+    )
+
 
-    # Try with numbers
+def first_free_username(base_username: str, taken) -> str:
+    """base_username, else the first of base_username1..999 not in taken"""
+    if base_username not in taken:
+        return base_username
     for i in range(1, 1000):
         suggestion = f"{base_username}{i}"
-        if not username_exists(db, suggestion):
+        if suggestion not in taken:
             return suggestion
 
     # Fallback: add random suffix
@@ -109,6 +253,13 @@ def suggest_username(db: Session, base_username: str) -> str:
     return suggestion
 
 
+def suggest_username(db: Session, base_username: str) -> str:
+    """Suggest an available username"""
+    # One query for the base name and its numbered variants
+    taken = {username for (username,) in db.query(User.username).filter(username_candidates_clause(base_username))}
+    return first_free_username(base_username, taken)
+
+
 # User Settings CRUD
 def get_user_settings(db: Session, user_id: int):
     """Get user settings"""
@@ -136,23 +287,222 @@ def update_user_progress(db: Session, user_id: int, **kwargs):
 
 
 def add_xp(db: Session, user_id: int, amount: int, source: str, source_id: int = None, description: str = None):
-    """Add XP to user's total and weekly XP"""
-    from database.models import XPTransaction
-
-    # Update user progress
-    progress = get_user_progress(db, user_id)
-    progress.total_xp += amount
-    db.commit()
-
-    # Log transaction
-    transaction = XPTransaction(
+    """Add XP to user's total and log the transaction atomically; returns the new total"""
+    # Incrementing server-side means concurrent awards can't overwrite each other
+    total_xp = db.execute(
+        update(UserProgress)
+        .where(UserProgress.user_id == user_id)
+        .values(total_xp=func.coalesce(UserProgress.total_xp, 0) + amount)
+        .returning(UserProgress.total_xp)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    if total_xp is None:
+        db.rollback()
+        raise ValueError(f"No progress row for user {user_id}")
+
+    # Log transaction and roll it into the daily and weekly aggregates in the same commit
+    created_at = datetime.utcnow()
+    db.execute(insert(XPTransaction).values(
         user_id=user_id,
         amount=amount,
         source=source,
         source_id=source_id,
-        description=description
+        description=description,
+        created_at=created_at
+    ))
+    for statement, rows in xp_aggregate_upserts(db.get_bind().dialect.name, [(user_id, created_at, amount)]):
+        db.execute(statement, rows)
+    db.commit()
+
+    return total_xp
+
+
+def add_xp_batch(db: Session, awards, batch_size: int = 500, commit: bool = True) -> dict:
+    """Apply many XP awards in one transaction; returns {user_id: new total}.
+
+    awards are dicts with user_id, amount, source and optionally source_id,
+    description and created_at. Each chunk of users is one UPDATE with a
+    CASE over their summed amounts; the ledger is one multi-row INSERT and
+    the daily and weekly aggregates one upsert each.
+    """
+    awards = list(awards)
+    totals_by_user = {}
+    for award in awards:
+        totals_by_user[award["user_id"]] = totals_by_user.get(award["user_id"], 0) + award["amount"]
+
+    now = datetime.utcnow()
+    new_totals = {}
+    user_ids = list(totals_by_user)
+    for start in range(0, len(user_ids), batch_size):
+        chunk = {user_id: totals_by_user[user_id] for user_id in user_ids[start:start + batch_size]}
+        rows = db.execute(
+            update(UserProgress)
+            .where(UserProgress.user_id.in_(chunk))
+            .values(total_xp=func.coalesce(UserProgress.total_xp, 0) + case(chunk, value=UserProgress.user_id, else_=0))
+            .returning(UserProgress.user_id, UserProgress.total_xp)
+            .execution_options(synchronize_session=False)
+        )
+        new_totals.update(rows.all())
+
+    ledger = [{
+        "user_id": award["user_id"],
+        "amount": award["amount"],
+        "source": award["source"],
+        "source_id": award.get("source_id"),
+        "description": award.get("description"),
+        "created_at": award.get("created_at") or now
+    } for award in awards if award["user_id"] in new_totals]
+    if ledger:
+        db.execute(insert(XPTransaction), ledger)
+        increments = [(row["user_id"], row["created_at"], row["amount"]) for row in ledger]
+        for statement, rows in xp_aggregate_upserts(db.get_bind().dialect.name, increments):
+            db.execute(statement, rows)
+    if commit:
+        db.commit()
+    return new_totals
+
+
+def get_xp_ledger_checkpoint(db: Session, journal: str) -> int:
+    """Last journal sequence number written by a write-behind XP buffer"""
+    checkpoint = db.get(XPLedgerCheckpoint, journal)
+    return checkpoint.last_seq if checkpoint is not None else 0
+
+
+def write_xp_ledger_batch(db: Session, awards, journal: str = None, last_seq: int = None) -> dict:
+    """Apply buffered XP awards and advance the journal checkpoint in one transaction"""
+    new_totals = add_xp_batch(db, awards, commit=False)
+    if journal is not None:
+        db.merge(XPLedgerCheckpoint(journal=journal, last_seq=last_seq))
+    db.commit()
+    return new_totals
+
+
+def rebuild_xp_aggregates(db: Session) -> int:
+    """Recompute the daily and weekly XP aggregates from the whole ledger and re-copy league placements; returns the daily row count"""
+    day_column = func.date(XPTransaction.created_at)
+    totals = db.query(XPTransaction.user_id, day_column, func.sum(XPTransaction.amount)).group_by(
+        XPTransaction.user_id, day_column
+    ).all()
+
+    daily, weekly = [], {}
+    for user_id, day, xp in totals:
+        day = day if isinstance(day, date) else date.fromisoformat(day)  # SQLite's date() returns text
+        daily.append({"user_id": user_id, "day": day, "xp": xp})
+        weekly[(user_id, week_start_of(day))] = weekly.get((user_id, week_start_of(day)), 0) + xp
+
+    db.query(XPDaily).delete(synchronize_session=False)
+    db.query(XPWeekly).delete(synchronize_session=False)
+    if daily:
+        db.execute(insert(XPDaily), daily)
+        db.execute(insert(XPWeekly), [
+            {"user_id": user_id, "week_start": week_start, "xp": xp}
+            for (user_id, week_start), xp in weekly.items()
+        ])
+    db.execute(mirror_league_placements(db.get_bind().dialect.name))
+    db.commit()
+    return len(daily)
+
+
+def get_weekly_xp(db: Session, user_id: int, week_start: date) -> int:
+    """XP a user earned in the ISO week starting on week_start"""
+    return db.query(XPWeekly.xp).filter(
+        XPWeekly.user_id == user_id,
+        XPWeekly.week_start == week_start
+    ).scalar() or 0
+
+
+def get_daily_xp(db: Session, user_id: int, start: date, end: date) -> dict:
+    """{day: XP} for the days between start and end (inclusive) with any XP"""
+    return dict(db.query(XPDaily.day, XPDaily.xp).filter(
+        XPDaily.user_id == user_id,
+        XPDaily.day.between(start, end)
+    ).all())
+
+
+# Quiz attempt CRUD
+def create_quiz_attempt(
+    db: Session,
+    user_id: int,
+    lesson_id: int,
+    score: int,
+    answers: list = None,
+    xp_earned: int = None,
+    completed_at: datetime = None
+):
+    """Record a graded quiz attempt"""
+    attempt = QuizAttempt(
+        user_id=user_id,
+        lesson_id=lesson_id,
+        score=score,
+        perfect_score=score == 100,
+        answers=answers,
+        xp_earned=xp_earned,
+        completed_at=completed_at or datetime.utcnow()
+    )
+    db.add(attempt)
+    db.commit()
+    return attempt
+
+
+def get_quiz_attempts(db: Session, user_id: int):
+    """Get a user's quiz attempts, oldest first"""
+    return db.query(QuizAttempt).filter(
+        QuizAttempt.user_id == user_id
+    ).order_by(QuizAttempt.completed_at, QuizAttempt.id).all()
+
+
+# League CRUD
+def get_league_by_name(db: Session, name: str):
+    """Get league by name"""
+    return db.query(League).filter(League.name == name).first()
+
+
+def upsert_league_participant(
+    db: Session,
+    user_id: int,
+    league_id: int,
+    week_start,
+    week_end,
+    weekly_xp: int,
+    league_order: dict = None
+):
+    """Record a user's weekly XP in their league cohort, moving them if their league changed.
+
+    One INSERT ... ON CONFLICT, so workers recording the same user's first
+    award of a week can't collide on idx_user_week. With league_order
+    ({league id: rank_order}) a user is only ever moved up, so a placement
+    from the weekly promotion job holds for the week. The placement is
+    copied onto the user's xp_weekly row, which leaderboards rank on.
+    """
+    statement = upsert_insert(db.get_bind().dialect.name, LeagueParticipant).values(
+        user_id=user_id,
+        league_id=league_id,
+        week_start=week_start,
+        week_end=week_end,
+        weekly_xp=weekly_xp
     )
-    db.add(transaction)
+    new_league_id = statement.excluded.league_id
+    if league_order is not None:
+        new_league_id = case(
+            (case(league_order, value=statement.excluded.league_id) > case(league_order, value=LeagueParticipant.league_id),
+             statement.excluded.league_id),
+            else_=LeagueParticipant.league_id
+        )
+    participant = db.scalar(statement.on_conflict_do_update(
+        index_elements=["user_id", "week_start"],
+        set_={"league_id": new_league_id, "weekly_xp": statement.excluded.weekly_xp}
+    ).returning(LeagueParticipant), execution_options={"populate_existing": True})
+    db.execute(mirror_league_placements(
+        db.get_bind().dialect.name,
+        LeagueParticipant.user_id == user_id,
+        LeagueParticipant.week_start == week_start
+    ))
     db.commit()
+    return participant
+
 
-    return progress.total_xp
+def get_latest_league_participant(db: Session, user_id: int):
+    """Get a user's most recent weekly league entry"""
+    return db.query(LeagueParticipant).filter(
+        LeagueParticipant.user_id == user_id
+    ).order_by(LeagueParticipant.week_start.desc()).first()
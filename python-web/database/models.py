@@ -24,6 +24,7 @@ class User(Base):
     native_language = Column(String(50), default="English")
     assessed_level = Column(String(20), nullable=True)  # Result from assessment
     profile_image_url = Column(Text, nullable=True)
+    interests = Column(JSON, nullable=True)  # Story topics picked at sign-up
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_login = Column(DateTime(timezone=True), nullable=True)
 
@@ -50,7 +51,7 @@ class UserProgress(Base):
 
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
     current_lesson = Column(Integer, default=0)  # 0 means assessment not done
-    lessons_completed = Column(ARRAY(Integer), default=[])
+    lessons_completed = Column(ARRAY(Integer).with_variant(JSON(), "sqlite"), default=[])  # JSON list on SQLite
     total_xp = Column(Integer, default=0)
     daily_streak = Column(Integer, default=0)
     last_activity_date = Column(Date, nullable=True)
@@ -116,6 +117,7 @@ class LeagueParticipant(Base):
 
     __table_args__ = (
         Index('idx_user_week', 'user_id', 'week_start', unique=True),
+        Index('idx_week_league', 'week_start', 'league_id'),
     )
 
 
@@ -145,3 +147,33 @@ class XPTransaction(Base):
     __table_args__ = (
         Index('idx_user_created', 'user_id', 'created_at'),
     )
+
+
+class XPLedgerCheckpoint(Base):
+    __tablename__ = "xp_ledger_checkpoints"
+
+    journal = Column(String(255), primary_key=True)  # host and path of a write-behind journal
+    last_seq = Column(Integer, nullable=False, default=0)  # last journal entry written to xp_transactions
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class XPDaily(Base):
+    __tablename__ = "xp_daily"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day the XP was earned
+    xp = Column(Integer, nullable=False, default=0)
+
+
+class XPWeekly(Base):
+    __tablename__ = "xp_weekly"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    week_start = Column(Date, primary_key=True)  # Monday of the ISO week, as in league_participants
+    xp = Column(Integer, nullable=False, default=0)
+    league_id = Column(Integer, ForeignKey('leagues.id'), nullable=True)  # copy of the week's placement, so boards rank on this table alone
+
+    __table_args__ = (
+        Index('idx_week_xp', week_start, xp.desc(), user_id),
+        Index('idx_week_league_xp', week_start, league_id, xp.desc(), user_id),
+    )
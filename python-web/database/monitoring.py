@@ -0,0 +1,93 @@
+"""
+Database monitoring
+Pool checkout timing, pool utilization and an opt-in slow-query log
+"""
+
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    """Checkout wait times for one pool, plus its configured capacity"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.errors = 0
+        self.queries = 0
+        self.slow_queries = 0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+class _TimedPoolMixin:
+    # _do_get blocks until a connection is free, so timing it is the checkout wait
+    pool_stats: PoolStats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            if self.pool_stats is not None:
+                self.pool_stats.errors += 1
+            raise
+        finally:
+            if self.pool_stats is not None:
+                self.pool_stats.record_wait(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    """QueuePool that records how long each checkout waited"""
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited"""
+
+
+def instrument_engine(engine, stats: PoolStats, slow_query_ms: float = 0):
+    """Attach pool stats and, when slow_query_ms > 0, log statements slower than that"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    sync_engine.pool.pool_stats = stats
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+        stats.queries += 1
+        if slow_query_ms and elapsed_ms >= slow_query_ms:
+            stats.slow_queries += 1
+            print(f"Slow query ({elapsed_ms:.1f} ms): {' '.join(statement.split())[:500]}")
+
+    # The pool is rebuilt on dispose(), so keep the stats attached to the new one
+    @event.listens_for(sync_engine, "engine_disposed")
+    def _reattach(engine):
+        engine.pool.pool_stats = stats
+
+
+def get_pool_stats(engine, stats: PoolStats) -> dict:
+    """Checkout wait times and how much of the pool is in use"""
+    pool = getattr(engine, "sync_engine", engine).pool
+    checked_out = pool.checkedout() if hasattr(pool, "checkedout") else None
+    return {
+        "pool": type(pool).__name__,
+        "checked_out": checked_out,
+        "capacity": stats.capacity,
+        "utilization": round(checked_out / stats.capacity, 4) if checked_out is not None and stats.capacity else None,
+        "checkouts": stats.checkouts,
+        "checkout_wait_ms_avg": round(stats.wait_seconds_total / stats.checkouts * 1000, 3) if stats.checkouts else None,
+        "checkout_wait_ms_max": round(stats.wait_seconds_max * 1000, 3),
+        "checkout_errors": stats.errors,
+        "queries": stats.queries,
+        "slow_queries": stats.slow_queries
+    }
@@ -0,0 +1,81 @@
+"""
+Fake OpenAI server for local load testing
+Answers /v1/chat/completions with a canned reply (optionally streamed) after a fixed delay
+
+Usage:
+    FAKE_OPENAI_LATENCY=2 python fake_openai_server.py
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://localhost:8090/v1 python app.py
+"""
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+import os
+import time
+import uuid
+
+app = FastAPI(title="Fake OpenAI")
+
+LATENCY_SECONDS = float(os.getenv("FAKE_OPENAI_LATENCY", "2"))
+TOKEN_DELAY_SECONDS = float(os.getenv("FAKE_OPENAI_TOKEN_DELAY", "0.02"))
+
+CANNED_REPLY = json.dumps({
+    "title": "Un Día en el Mercado",
+    "content": "María camina por el mercado. 'Buenos días,' dice el vendedor.",
+    "difficulty": "beginner",
+    "vocabulary_count": 20
+})
+
+
+def _chunk(completion_id, model, delta, finish_reason=None):
+    return "data: " + json.dumps({
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    }) + "\n\n"
+
+
+async def _stream_reply(completion_id, model):
+    # First token arrives after LATENCY_SECONDS, the rest every TOKEN_DELAY_SECONDS
+    await asyncio.sleep(LATENCY_SECONDS)
+    yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+    for word in CANNED_REPLY.split(" "):
+        yield _chunk(completion_id, model, {"content": word + " "})
+        await asyncio.sleep(TOKEN_DELAY_SECONDS)
+    yield _chunk(completion_id, model, {}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Return a canned chat completion after LATENCY_SECONDS"""
+    body = await request.json()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "gpt-4o-mini")
+
+    if body.get("stream"):
+        return StreamingResponse(_stream_reply(completion_id, model), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY_SECONDS)
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": CANNED_REPLY},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.getenv("FAKE_OPENAI_PORT", 8090))
+    uvicorn.run(app, host="127.0.0.1", port=port)
@@ -0,0 +1,36 @@
+"""
+Import users from the legacy system
+Reads one JSON object per line (email, username, target_language, password_hash, ...)
+Rows with a plain "password" instead of "password_hash" are hashed across all CPU cores
+
+Usage:
+    python import_users.py legacy_users.jsonl
+"""
+
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import init_db, SessionLocal
+from database import crud
+
+
+def read_users(path):
+    """Yield user dicts from a JSON-lines file"""
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    init_db()
+    start = time.perf_counter()
+    with SessionLocal() as db, ProcessPoolExecutor() as hashers:
+        created = crud.bulk_create_users(db, read_users(sys.argv[1]), executor=hashers)
+    print(f"✅ Imported {created} users in {time.perf_counter() - start:.1f}s (existing accounts skipped)")
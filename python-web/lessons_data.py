@@ -3,6 +3,9 @@
 Each lesson includes: story, vocabulary, grammar point, and quiz
 """
 
+from collections.abc import Mapping
+from types import MappingProxyType
+
 LESSONS = [
     # Beginner Lessons (1-10)
     {
@@ -911,17 +914,77 @@ LESSONS = [
     }
 ]
 
+def freeze(value):
+    """Read-only copy of nested lesson data: dicts become mapping proxies and lists tuples"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    """Plain dict/list copy of frozen lesson data, for serializing or editing"""
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+class LessonCatalog:
+    """Read-only indexes over the curriculum, built once at import.
+
+    id -> lesson, level -> tuple of lessons and (lesson id, question id) ->
+    question are all O(1). Lessons are deep-frozen copies (mapping proxies
+    and tuples all the way down), so the catalog can be shared across
+    threads and requests without one caller corrupting it for the rest;
+    thaw() gives a plain copy.
+    """
+
+    __slots__ = ("lessons", "by_id", "by_level", "questions")
+
+    def __init__(self, lessons):
+        lessons = [freeze(lesson) for lesson in lessons]
+        by_level = {}
+        questions = {}
+        for lesson in lessons:
+            by_level.setdefault(lesson["level"], []).append(lesson)
+            questions[lesson["id"]] = MappingProxyType({q["id"]: q for q in lesson.get("quiz", [])})
+
+        object.__setattr__(self, "lessons", tuple(lessons))
+        object.__setattr__(self, "by_id", MappingProxyType({lesson["id"]: lesson for lesson in lessons}))
+        object.__setattr__(self, "by_level", MappingProxyType({level: tuple(items) for level, items in by_level.items()}))
+        object.__setattr__(self, "questions", MappingProxyType(questions))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("LessonCatalog is immutable")
+
+    def __len__(self):
+        return len(self.lessons)
+
+    def get(self, lesson_id: int):
+        """Lesson by ID, or None"""
+        return self.by_id.get(lesson_id)
+
+    def for_level(self, level: str):
+        """Lessons for a level, in curriculum order"""
+        return self.by_level.get(level, ())
+
+    def get_question(self, lesson_id: int, question_id: int):
+        """Quiz question by lesson and question ID, or None"""
+        return self.questions.get(lesson_id, {}).get(question_id)
+
+
+LESSON_CATALOG = LessonCatalog(LESSONS)
+
 def get_lesson_by_id(lesson_id: int):
     """Get a specific lesson by ID"""
-    for lesson in LESSONS:
-        if lesson["id"] == lesson_id:
-            return lesson
-    return None
+    return LESSON_CATALOG.get(lesson_id)
 
 def get_lessons_by_level(level: str):
     """Get all lessons for a specific level"""
-    return [lesson for lesson in LESSONS if lesson["level"] == level]
+    return LESSON_CATALOG.for_level(level)
 
 def get_all_lessons():
     """Get all 30 lessons"""
-    return LESSONS
+    return LESSON_CATALOG.lessons
@@ -0,0 +1,114 @@
+"""
+Grading service
+Quizzes compiled once into hash lookups of normalized accepted answers
+"""
+
+import unicodedata
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Score (percent) needed to pass a quiz
+PASSING_SCORE = 70
+
+# Question types whose free-text answers ignore accents as well as case and spacing
+ACCENT_INSENSITIVE_TYPES = frozenset({"fill_blank"})
+
+
+def normalize_answer(text: str, fold_accents: bool = False) -> str:
+    """Case-fold and collapse whitespace, optionally dropping accents too"""
+    text = " ".join(str(text).split()).casefold()
+    if fold_accents:
+        decomposed = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return unicodedata.normalize("NFC", text)
+
+
+class CompiledQuiz:
+    """One lesson's quiz with every accepted answer normalized up front.
+
+    Questions are read from the catalog's question_id -> question index;
+    each id also maps to (fold_accents, accepted answers), so grading an
+    answer is a dict lookup, one normalization of the user's text and one
+    set membership test. A question's "correct" answer is always accepted;
+    an optional "accepted" list adds alternatives.
+    """
+
+    __slots__ = ("lesson_id", "total_questions", "_questions", "_answers")
+
+    def __init__(self, lesson_id: int, questions: Mapping[int, dict]):
+        self.lesson_id = lesson_id
+        self.total_questions = len(questions)
+        self._questions = questions
+        self._answers: Dict[int, tuple] = {}
+        for question_id, question in questions.items():
+            fold_accents = question.get("type") in ACCENT_INSENSITIVE_TYPES
+            accepted = frozenset(
+                normalize_answer(answer, fold_accents)
+                for answer in [question["correct"], *question.get("accepted", [])]
+            )
+            self._answers[question_id] = (fold_accents, accepted)
+
+    def is_correct(self, question_id: int, answer: str) -> Optional[bool]:
+        """Whether an answer is accepted, or None for an unknown question"""
+        entry = self._answers.get(question_id)
+        if entry is None:
+            return None
+        fold_accents, accepted = entry
+        return normalize_answer(answer, fold_accents) in accepted
+
+    def grade(self, answers: Iterable[Tuple[int, str]]) -> dict:
+        """Score (question_id, answer) pairs; unknown and repeated questions are ignored"""
+        correct_answers = 0
+        detailed_results = []
+        graded = set()
+
+        for question_id, answer in answers:
+            entry = self._answers.get(question_id)
+            if entry is None or question_id in graded:
+                continue
+            graded.add(question_id)
+            question = self._questions[question_id]
+            fold_accents, accepted = entry
+            is_correct = normalize_answer(answer, fold_accents) in accepted
+            if is_correct:
+                correct_answers += 1
+
+            detailed_results.append({
+                "question_id": question_id,
+                "question": question["question"],
+                "user_answer": answer,
+                "correct_answer": question["correct"],
+                "is_correct": is_correct
+            })
+
+        score = int((correct_answers / self.total_questions) * 100) if self.total_questions > 0 else 0
+        return {
+            "score": score,
+            "passed": score >= PASSING_SCORE,
+            "correct_answers": correct_answers,
+            "total_questions": self.total_questions,
+            "detailed_results": detailed_results
+        }
+
+
+class GradingEngine:
+    """Compiled quizzes for every lesson in a LessonCatalog, built once at startup"""
+
+    def __init__(self, catalog):
+        self._quizzes: Dict[int, CompiledQuiz] = {
+            lesson_id: CompiledQuiz(lesson_id, questions)
+            for lesson_id, questions in catalog.questions.items()
+            if questions
+        }
+
+    def get(self, lesson_id: int) -> Optional[CompiledQuiz]:
+        """Compiled quiz for a lesson, or None if it has no quiz"""
+        return self._quizzes.get(lesson_id)
+
+    def grade(self, lesson_id: int, answers: Iterable[Tuple[int, str]]) -> Optional[dict]:
+        """Grade one submission, or None if the lesson has no quiz"""
+        quiz = self._quizzes.get(lesson_id)
+        return quiz.grade(answers) if quiz is not None else None
+
+    def grade_batch(self, submissions: Iterable[Tuple[int, Iterable[Tuple[int, str]]]]) -> List[Optional[dict]]:
+        """Grade (lesson_id, answers) submissions in order; None where a lesson has no quiz"""
+        return [self.grade(lesson_id, answers) for lesson_id, answers in submissions]
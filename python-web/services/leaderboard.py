@@ -0,0 +1,171 @@
+"""
+Leaderboard service
+Incremental weekly ranking kept sorted by weekly XP
+"""
+
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """Order-statistic leaderboard keyed by weekly XP.
+
+    Updating one user costs O(log N); rank lookups and top-K reads never
+    rebuild or re-sort the whole board. A finished week is kept as a frozen,
+    read-only board.
+    """
+
+    def __init__(self):
+        self._ranking = SortedList()  # (-weekly_xp, email)
+        self._keys: Dict[str, tuple] = {}  # email -> ranking key
+        self._rows: Dict[str, dict] = {}  # email -> public row
+        self.frozen = False
+
+    def __len__(self):
+        return len(self._ranking)
+
+    def __contains__(self, email):
+        return email in self._keys
+
+    def _check_writable(self):
+        if self.frozen:
+            raise RuntimeError("Leaderboard snapshot is read-only")
+
+    def freeze(self) -> 'Leaderboard':
+        """Make the board read-only and return it"""
+        self.frozen = True
+        return self
+
+    def update(self, email: str, row: dict):
+        """Insert or move a user; row must contain 'weekly_xp'"""
+        self._check_writable()
+        key = (-row['weekly_xp'], email)
+        old_key = self._keys.get(email)
+        if old_key != key:
+            if old_key is not None:
+                self._ranking.remove(old_key)
+            self._ranking.add(key)
+            self._keys[email] = key
+        self._rows[email] = row
+
+    def remove(self, email: str):
+        """Drop a user from the board"""
+        self._check_writable()
+        key = self._keys.pop(email, None)
+        if key is not None:
+            self._ranking.remove(key)
+            del self._rows[email]
+
+    def clear(self):
+        """Remove every entry"""
+        self._check_writable()
+        self._ranking.clear()
+        self._keys.clear()
+        self._rows.clear()
+
+    def get(self, email: str) -> Optional[dict]:
+        """Get a user's row"""
+        row = self._rows.get(email)
+        return dict(row) if row is not None else None
+
+    def rank(self, email: str) -> Optional[int]:
+        """1-based rank of a user, or None if not ranked"""
+        key = self._keys.get(email)
+        if key is None:
+            return None
+        return self._ranking.index(key) + 1
+
+    def iter_ranked(self, start: int = 0) -> Iterator[dict]:
+        """Iterate rows in rank order starting at a 0-based position"""
+        for _, email in self._ranking.islice(start):
+            yield self._rows[email]
+
+    def top(self, limit: int) -> List[dict]:
+        """Top N rows"""
+        return list(islice(self.iter_ranked(), max(limit, 0)))
+
+    def around(self, email: str, radius: int) -> List[dict]:
+        """Rows within radius places of a user, each tagged with its rank"""
+        rank = self.rank(email)
+        if rank is None:
+            return []
+
+        radius = max(radius, 0)
+        start = max(rank - 1 - radius, 0)
+        rows = islice(self.iter_ranked(start), rank + radius - start)
+        return [dict(row, rank=start + i + 1) for i, row in enumerate(rows)]
+
+
+class LeagueLeaderboard:
+    """Weekly leaderboard partitioned by league.
+
+    Keeps the overall ranking plus one Leaderboard per league. A user whose
+    XP change crosses a league boundary is moved between partitions, so
+    per-league top-K and counts are direct reads instead of filters over the
+    whole board.
+    """
+
+    def __init__(self, league_ids):
+        self.overall = Leaderboard()
+        self.partitions: Dict[str, Leaderboard] = {league_id: Leaderboard() for league_id in league_ids}
+        self._membership: Dict[str, str] = {}  # email -> league_id
+
+    def __len__(self):
+        return len(self.overall)
+
+    def __contains__(self, email):
+        return email in self.overall
+
+    @property
+    def frozen(self):
+        return self.overall.frozen
+
+    def freeze(self) -> 'LeagueLeaderboard':
+        """Make the board and every partition read-only and return it"""
+        self.overall.freeze()
+        for board in self.partitions.values():
+            board.freeze()
+        return self
+
+    def update(self, email: str, row: dict):
+        """Insert or move a user; row must contain 'weekly_xp' and 'league'"""
+        league_id = row['league']
+        old_league_id = self._membership.get(email)
+        if old_league_id is not None and old_league_id != league_id:
+            self.partitions[old_league_id].remove(email)
+
+        self.overall.update(email, row)
+        self.partitions[league_id].update(email, row)
+        self._membership[email] = league_id
+
+    def remove(self, email: str):
+        """Drop a user from the board"""
+        league_id = self._membership.pop(email, None)
+        if league_id is not None:
+            self.partitions[league_id].remove(email)
+        self.overall.remove(email)
+
+    def league_of(self, email: str) -> Optional[str]:
+        """League partition a user is ranked in"""
+        return self._membership.get(email)
+
+    def partition(self, league_id: str) -> Leaderboard:
+        """Leaderboard of a single league"""
+        return self.partitions[league_id]
+
+    def get(self, email: str) -> Optional[dict]:
+        return self.overall.get(email)
+
+    def rank(self, email: str) -> Optional[int]:
+        return self.overall.rank(email)
+
+    def iter_ranked(self, start: int = 0) -> Iterator[dict]:
+        return self.overall.iter_ranked(start)
+
+    def top(self, limit: int) -> List[dict]:
+        return self.overall.top(limit)
+
+    def around(self, email: str, radius: int) -> List[dict]:
+        return self.overall.around(email, radius)
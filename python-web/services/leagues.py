@@ -0,0 +1,59 @@
+"""
+League service
+Resolves leagues from XP totals using precompiled thresholds
+"""
+
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# numpy is optional - bulk classification falls back to bisect without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class LeagueTable:
+    """Sorted league thresholds compiled once from a LEAGUES mapping.
+
+    Leagues are ordered by min_xp, so resolving a league is a single bisect
+    over the thresholds instead of a scan over every league's bounds.
+    """
+
+    def __init__(self, leagues: dict):
+        ordered = sorted(leagues.items(), key=lambda item: item[1]['min_xp'])
+        self.league_ids: Tuple[str, ...] = tuple(league_id for league_id, _ in ordered)
+        self.index: Dict[str, int] = {league_id: i for i, league_id in enumerate(self.league_ids)}
+        self.thresholds: Tuple[int, ...] = tuple(data['min_xp'] for _, data in ordered)
+        self._np_thresholds = np.asarray(self.thresholds) if NUMPY_AVAILABLE else None
+
+    def _index(self, total_xp) -> int:
+        return max(bisect_right(self.thresholds, total_xp) - 1, 0)
+
+    def resolve(self, total_xp) -> str:
+        """League id for an XP total"""
+        return self.league_ids[self._index(total_xp)]
+
+    def _indexes(self, totals: Iterable) -> List[int]:
+        if self._np_thresholds is not None:
+            indexes = np.searchsorted(self._np_thresholds, np.asarray(list(totals)), side='right') - 1
+            return np.maximum(indexes, 0).tolist()
+        return [self._index(total_xp) for total_xp in totals]
+
+    def resolve_many(self, totals: Iterable) -> List[str]:
+        """League ids for many XP totals in one call"""
+        return [self.league_ids[i] for i in self._indexes(totals)]
+
+    def next_league(self, total_xp, league_id: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """(next league id, XP needed to reach it), or None at the top league.
+
+        By default the next league is the one after the league total_xp
+        earns; pass a placement (which promotions can lift above that) to
+        get the one after it instead. XP needed is what earns the league
+        outright, never negative.
+        """
+        index = (self.index[league_id] if league_id is not None else self._index(total_xp)) + 1
+        if index >= len(self.league_ids):
+            return None
+        return self.league_ids[index], max(self.thresholds[index] - total_xp, 0)
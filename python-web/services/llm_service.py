@@ -0,0 +1,166 @@
+"""
+LLM service
+Non-blocking OpenAI chat completions over one pooled, instrumented client
+"""
+
+import asyncio
+import importlib.util
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import httpx
+import openai
+
+# Configuration
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "256"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "256"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+# HTTP/2 needs the optional h2 package
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+LLM_HTTP2 = HTTP2_AVAILABLE and os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+# Maximum in-flight upstream calls per endpoint; extra requests wait their turn
+ENDPOINT_CONCURRENCY = {
+    "story": int(os.getenv("LLM_STORY_CONCURRENCY", "32")),
+    "explain": int(os.getenv("LLM_EXPLAIN_CONCURRENCY", "64")),
+    "chat": int(os.getenv("LLM_CHAT_CONCURRENCY", "256")),
+}
+DEFAULT_CONCURRENCY = 32
+
+_client: Optional[openai.AsyncOpenAI] = None
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+# Connection instrumentation
+_stats = {"calls": 0, "new_connections": 0, "ttfb_ms_total": 0.0}
+_recent_ttfb_ms = deque(maxlen=1000)
+
+
+class _CallTrace:
+    """httpcore trace hook that notes whether a call had to open a connection"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.new_connection = False
+
+    async def __call__(self, event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            self.new_connection = True
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions["trace"] = _CallTrace()
+
+
+async def _on_response(response: httpx.Response):
+    # Response hooks run once headers arrive, i.e. at time-to-first-byte
+    trace = response.request.extensions.get("trace")
+    if not isinstance(trace, _CallTrace):
+        return
+
+    ttfb_ms = (time.perf_counter() - trace.started) * 1000
+    _stats["calls"] += 1
+    _stats["new_connections"] += trace.new_connection
+    _stats["ttfb_ms_total"] += ttfb_ms
+    _recent_ttfb_ms.append(ttfb_ms)
+
+
+def init_client() -> openai.AsyncOpenAI:
+    """Create the process-wide OpenAI client (OPENAI_BASE_URL points it at a fake server)"""
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            http2=LLM_HTTP2,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_SECONDS
+            ),
+            timeout=LLM_TIMEOUT_SECONDS,
+            event_hooks={"request": [_on_request], "response": [_on_response]}
+        )
+        _client = openai.AsyncOpenAI(
+            api_key=openai.api_key,
+            timeout=LLM_TIMEOUT_SECONDS,
+            max_retries=LLM_MAX_RETRIES,
+            http_client=http_client
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client and its connection pool"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def get_client() -> openai.AsyncOpenAI:
+    """Get the shared async OpenAI client"""
+    return _client or init_client()
+
+
+def get_stats() -> dict:
+    """Connection reuse and time-to-first-byte figures for upstream calls"""
+    calls = _stats["calls"]
+    recent = sorted(_recent_ttfb_ms)
+    return {
+        "calls": calls,
+        "new_connections": _stats["new_connections"],
+        "connection_reuse_rate": round(1 - _stats["new_connections"] / calls, 4) if calls else None,
+        "avg_ttfb_ms": round(_stats["ttfb_ms_total"] / calls, 2) if calls else None,
+        "p50_ttfb_ms": round(recent[len(recent) // 2], 2) if recent else None,
+        "p95_ttfb_ms": round(recent[int(len(recent) * 0.95)], 2) if recent else None,
+        "http2": LLM_HTTP2
+    }
+
+
+def _semaphore(endpoint: str) -> asyncio.Semaphore:
+    semaphore = _semaphores.get(endpoint)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ENDPOINT_CONCURRENCY.get(endpoint, DEFAULT_CONCURRENCY))
+        _semaphores[endpoint] = semaphore
+    return semaphore
+
+
+async def chat_completion(endpoint: str, timeout: float = LLM_TIMEOUT_SECONDS, **kwargs):
+    """Run a chat completion without blocking the event loop.
+
+    Raises asyncio.TimeoutError if the endpoint's queue wait plus the
+    upstream call take longer than timeout seconds.
+    """
+    async def _call():
+        async with _semaphore(endpoint):
+            return await get_client().chat.completions.create(**kwargs)
+
+    return await asyncio.wait_for(_call(), timeout=timeout)
+
+
+async def stream_chat_completion(endpoint: str, timeout: float = LLM_TIMEOUT_SECONDS, **kwargs):
+    """Yield content deltas of a chat completion as the model produces them.
+
+    Raises asyncio.TimeoutError if the endpoint's queue wait plus the time
+    to the upstream response headers exceed timeout seconds.
+    """
+    semaphore = _semaphore(endpoint)
+    deadline = time.monotonic() + timeout
+    await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+
+    stream = None
+    try:
+        stream = await asyncio.wait_for(
+            get_client().chat.completions.create(stream=True, **kwargs),
+            timeout=max(deadline - time.monotonic(), 0)
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        if stream is not None:
+            await stream.response.aclose()
+        semaphore.release()
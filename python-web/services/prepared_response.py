@@ -0,0 +1,111 @@
+"""
+Prepared response service
+Bodies serialized once, with a strong ETag and precompressed variants
+"""
+
+import gzip
+import hashlib
+import json
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# brotli is optional - without it only gzip variants are built
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+def _accepted_encodings(header: str) -> set:
+    encodings = set()
+    for part in header.split(","):
+        name, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name and quality > 0:
+            encodings.add(name.lower())
+    return encodings
+
+
+class PreparedPayload:
+    """An immutable response body with its ETag and gzip/brotli variants.
+
+    respond() answers If-None-Match (or If-Modified-Since) with 304 and
+    otherwise sends the best precompressed variant the client accepts, so
+    nothing is serialized or compressed per request. Pass compress=False
+    for bodies that are already compressed, such as images.
+    """
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = "no-cache",
+                 last_modified: Optional[str] = None, compress: bool = True):
+        self.body = body
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.last_modified = last_modified
+
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.variants = {}  # content-encoding -> (etag, body)
+        if compress and len(body) >= MIN_COMPRESS_SIZE:
+            if BROTLI_AVAILABLE:
+                self.variants["br"] = (f'"{digest}-br"', brotli.compress(body))
+            self.variants["gzip"] = (f'"{digest}-gzip"', gzip.compress(body, compresslevel=9, mtime=0))
+        self._etags = {self.etag} | {etag for etag, _ in self.variants.values()}
+
+    @classmethod
+    def json(cls, content, **kwargs) -> "PreparedPayload":
+        """Serialize content the same way JSONResponse does"""
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+        return cls(body, "application/json", **kwargs)
+
+    def not_modified(self, request: Request, etag: Optional[str] = None) -> bool:
+        """Whether the client's If-None-Match (or If-Modified-Since) already matches this body.
+
+        etag is the tag of the variant being served; by default any variant matches.
+        """
+        header = request.headers.get("if-none-match")
+        if header:
+            tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+            return "*" in tags or not tags.isdisjoint({etag} if etag is not None else self._etags)
+
+        since = request.headers.get("if-modified-since")
+        if since and self.last_modified:
+            try:
+                return parsedate_to_datetime(self.last_modified) <= parsedate_to_datetime(since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def respond(self, request: Request) -> Response:
+        """304, or the best encoded variant the client accepts"""
+        headers = {"Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+
+        # Pick the variant first, so the 304 check and its ETag are the ones this client is served
+        etag, body, encoding = self.etag, self.body, None
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        for candidate in ("br", "gzip"):
+            if candidate in self.variants and candidate in accepted:
+                (etag, body), encoding = self.variants[candidate], candidate
+                break
+        headers["ETag"] = etag
+
+        if self.not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=self.media_type, headers=headers)
@@ -0,0 +1,59 @@
+"""
+Promotion service
+End-of-week league results: rank each cohort, flag promotions and demotions, place users for next week
+"""
+
+from typing import Dict, List, Sequence
+
+from services.leagues import LeagueTable
+
+# numpy is optional - cohorts are settled with plain lists without it
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class PromotionRules(LeagueTable):
+    """League order plus how many of each cohort move at the end of a week.
+
+    The top promotion_threshold users of a cohort who earned any XP that
+    week move up one league and the bottom demotion_threshold move down
+    one. Nobody is placed below the league their total XP earns (the
+    LeagueTable thresholds), so the XP tiers stay a floor. The top league
+    never promotes and the bottom one never demotes.
+    """
+
+    def __init__(self, leagues: dict):
+        super().__init__(leagues)
+        last = len(self.league_ids) - 1
+        self.promote_top: Dict[str, int] = {
+            league_id: (leagues[league_id].get('promotion_threshold') or 0) if i < last else 0
+            for i, league_id in enumerate(self.league_ids)
+        }
+        self.demote_bottom: Dict[str, int] = {
+            league_id: (leagues[league_id].get('demotion_threshold') or 0) if i > 0 else 0
+            for i, league_id in enumerate(self.league_ids)
+        }
+
+    def place(self, league_id: str, rank: int, size: int, weekly_xp: int, total_xp: int) -> int:
+        """Next week's league index for one member of a cohort of size users"""
+        promoted = rank <= self.promote_top[league_id] and weekly_xp > 0
+        demoted = rank > size - self.demote_bottom[league_id] and not promoted
+        return max(self.index[league_id] + promoted - demoted, self._index(total_xp))
+
+    def settle(self, league_id: str, weekly_xp: Sequence[int], total_xp: Sequence[int]) -> List[int]:
+        """Next week's league index for each member of a cohort, given in rank order"""
+        size = len(weekly_xp)
+        if NUMPY_AVAILABLE:
+            ranks = np.arange(1, size + 1)
+            promoted = (ranks <= self.promote_top[league_id]) & (np.asarray(weekly_xp) > 0)
+            demoted = (ranks > size - self.demote_bottom[league_id]) & ~promoted
+            moved = self.index[league_id] + promoted.astype(int) - demoted.astype(int)
+            return np.maximum(moved, np.asarray(self._indexes(total_xp), dtype=int)).tolist()
+
+        return [
+            self.place(league_id, rank, size, weekly, total)
+            for rank, (weekly, total) in enumerate(zip(weekly_xp, total_xp), start=1)
+        ]
@@ -0,0 +1,116 @@
+"""
+Response cache service
+Content-addressed LRU/TTL cache for LLM responses, optionally shared via Redis
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Redis is optional - without it each process keeps its own cache
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+def normalize_text(value: str) -> str:
+    """Case-fold and collapse whitespace so trivially different inputs share a key"""
+    return " ".join(str(value).split()).casefold()
+
+
+def make_key(*parts) -> str:
+    """SHA-256 over the normalized parts"""
+    joined = "\x1f".join(normalize_text(part) for part in parts)
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU with per-entry TTL, backed by Redis when a URL is given.
+
+    Lookups hit the local LRU first; on a local miss Redis is consulted and
+    the result is kept locally, so repeated hits stay in-process.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 10000, ttl_seconds: float = 3600,
+                 redis_url: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._redis = aioredis.from_url(redis_url) if redis_url and REDIS_AVAILABLE else None
+        self._stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0, "redis_errors": 0}
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _get_local(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: Any, ttl_seconds: float):
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Cached value for a key, or None"""
+        value = self._get_local(key)
+        if value is not None:
+            self._stats["hits"] += 1
+            return value
+
+        if self._redis is not None:
+            try:
+                raw = await self._redis.get(self._redis_key(key))
+                if raw is not None:
+                    ttl = await self._redis.ttl(self._redis_key(key))
+                    value = json.loads(raw)
+                    self._set_local(key, value, ttl if ttl > 0 else self.ttl_seconds)
+                    self._stats["redis_hits"] += 1
+                    return value
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                print(f"Response cache Redis read failed: {e}")
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        """Store a value locally and in Redis"""
+        self._set_local(key, value, self.ttl_seconds)
+
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._redis_key(key), json.dumps(value), ex=int(self.ttl_seconds))
+            except Exception as e:
+                self._stats["redis_errors"] += 1
+                print(f"Response cache Redis write failed: {e}")
+
+    async def close(self):
+        """Close the Redis connection pool if there is one"""
+        if self._redis is not None:
+            await self._redis.close()
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters and current size"""
+        lookups = self._stats["hits"] + self._stats["redis_hits"] + self._stats["misses"]
+        hits = self._stats["hits"] + self._stats["redis_hits"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "redis": self._redis is not None
+        }
@@ -0,0 +1,47 @@
+"""
+Single-flight service
+Coalesces identical concurrent calls into one shared upstream call
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from services.response_cache import make_key
+
+
+class SingleFlight:
+    """Share one in-flight call between concurrent callers with the same key.
+
+    The first caller starts the call as its own task; later callers with an
+    equal key await that same task, so a caller disconnecting does not
+    cancel the result for everyone else. key_func turns the key parts into
+    the dedupe key (normalized SHA-256 by default).
+    """
+
+    def __init__(self, key_func: Callable[..., str] = make_key):
+        self.key_func = key_func
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._stats = {"calls": 0, "upstream_calls": 0, "coalesced": 0}
+
+    def key(self, *parts) -> str:
+        """Dedupe key for a set of request fields"""
+        return self.key_func(*parts)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn, or join the identical call already in flight"""
+        self._stats["calls"] += 1
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats["coalesced"] += 1
+        else:
+            self._stats["upstream_calls"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> dict:
+        """How many calls were coalesced onto another in-flight call"""
+        return {**self._stats, "in_flight": len(self._inflight)}
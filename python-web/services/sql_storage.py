@@ -0,0 +1,564 @@
+"""
+SQL storage service
+Storage backend on the SQLAlchemy models: SQLite for local runs, Postgres in production
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import Date, and_, case, func, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import AsyncSessionLocal, async_engine, async_crud, crud, get_engine_stats, init_async_db
+from database.models import League, LeagueParticipant, Lesson, User, UserProgress, XPTransaction, XPWeekly
+from lessons_data import thaw
+from services.grading import PASSING_SCORE
+from services.promotions import PromotionRules
+from services.storage import DuplicateUserError, Storage, UnknownUserError, Week
+from services.xp_ledger import XPLedger
+
+# The built-in curriculum teaches Spanish
+CURRICULUM_LANGUAGE = "Spanish"
+
+def week_bounds(week: Week):
+    """(Monday, Sunday) dates of an ISO week"""
+    week_start = date.fromisocalendar(week[0], week[1], 1)
+    return week_start, week_start + timedelta(days=6)
+
+
+def _parse_time(value: Optional[str]) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+class SQLLeaderboard:
+    """One week's league cohorts with the LeagueLeaderboard read API.
+
+    Every read is an awaited query, so all workers and nodes see the same
+    ranking. Boards rank on the xp_weekly aggregate, which carries each
+    placed user's league, so paging and rank counts are range scans of
+    idx_week_league_xp (idx_week_xp for the whole week). Rows show the
+    weekly XP they are ranked by: awards still in the write-behind buffer
+    count once they are written. Ties are broken by user id, i.e. who
+    signed up first.
+    """
+
+    def __init__(self, storage: "SQLStorage", week_start: date, league_id: Optional[str] = None):
+        self._storage = storage
+        self.week_start = week_start
+        self.league_id = league_id
+        self.frozen = False
+
+    def _select(self, *columns):
+        query = select(*columns).select_from(XPWeekly).where(XPWeekly.week_start == self.week_start)
+        if self.league_id is not None:
+            return query.where(XPWeekly.league_id == self._storage.league_db_ids[self.league_id])
+        return query.where(XPWeekly.league_id.isnot(None))
+
+    async def _rows(self, offset: int, limit: int):
+        async with self._storage.session() as db:
+            rows = (await db.execute(self._select(
+                User.id,
+                User.email,
+                User.username,
+                XPWeekly.xp,
+                XPWeekly.league_id,
+                LeagueParticipant.promoted,
+                LeagueParticipant.demoted,
+                UserProgress.total_xp,
+                UserProgress.daily_streak
+            ).join(User, User.id == XPWeekly.user_id).join(LeagueParticipant, and_(
+                LeagueParticipant.user_id == XPWeekly.user_id,
+                LeagueParticipant.week_start == XPWeekly.week_start
+            )).outerjoin(UserProgress, UserProgress.user_id == XPWeekly.user_id).order_by(
+                XPWeekly.xp.desc(), XPWeekly.user_id
+            ).offset(offset).limit(limit))).all()
+
+        return [{
+            'email': email,
+            'username': username,
+            'weekly_xp': weekly_xp,
+            'total_xp': (total_xp or 0) + self._storage.pending_xp(user_id),
+            'league': self._storage.league_keys[league_db_id],
+            'streak_days': streak_days or 0,
+            'promoted': bool(promoted),
+            'demoted': bool(demoted)
+        } for user_id, email, username, weekly_xp, league_db_id, promoted, demoted, total_xp, streak_days in rows]
+
+    async def count(self) -> int:
+        """Number of ranked users"""
+        async with self._storage.session() as db:
+            return await db.scalar(self._select(func.count())) or 0
+
+    def partition(self, league_id: str) -> "SQLLeaderboard":
+        """Leaderboard of a single league"""
+        return SQLLeaderboard(self._storage, self.week_start, league_id)
+
+    async def _placement(self, db, email: str):
+        # (user id, weekly XP, league id) of a ranked user, or None
+        return (await db.execute(self._select(XPWeekly.user_id, XPWeekly.xp, XPWeekly.league_id).join(
+            User, User.id == XPWeekly.user_id
+        ).where(User.email == email).limit(1))).first()
+
+    async def league_of(self, email: str) -> Optional[str]:
+        """League a user is placed in this week"""
+        async with self._storage.session() as db:
+            placement = await self._placement(db, email)
+        return self._storage.league_keys[placement[2]] if placement is not None else None
+
+    async def rank(self, email: str) -> Optional[int]:
+        """1-based rank of a user, or None if not ranked"""
+        async with self._storage.session() as db:
+            placement = await self._placement(db, email)
+            if placement is None:
+                return None
+            user_id, weekly_xp, _ = placement
+            # Two range counts on the index instead of one OR that scans the cohort
+            more_xp = await db.scalar(self._select(func.count()).where(XPWeekly.xp > weekly_xp))
+            tied_before = await db.scalar(self._select(func.count()).where(
+                XPWeekly.xp == weekly_xp, XPWeekly.user_id < user_id
+            ))
+        return more_xp + tied_before + 1
+
+    async def top(self, limit: int):
+        """Top N rows"""
+        return await self._rows(0, max(limit, 0))
+
+    async def around(self, email: str, radius: int):
+        """Rows within radius places of a user, each tagged with its rank"""
+        rank = await self.rank(email)
+        if rank is None:
+            return []
+
+        radius = max(radius, 0)
+        start = max(rank - 1 - radius, 0)
+        rows = await self._rows(start, rank + radius - start)
+        return [dict(row, rank=start + i + 1) for i, row in enumerate(rows)]
+
+
+class SQLStorage(Storage):
+    """Storage on the database package, shared by every worker and node.
+
+    Requests go through AsyncSession and async_crud, so a slow query only
+    suspends the request waiting on it. Users map to User, per-lesson
+    progress to QuizAttempt rows plus UserProgress.lessons_completed, XP to
+    UserProgress and the XPTransaction ledger, and each week's leaderboard
+    to LeagueParticipant rows. Tables, leagues and the curriculum's Lesson
+    rows are created on first use. With xp_write_behind, XP awards go
+    through an XPLedger and reach the database in bulk from its flusher
+    task; reads add the XP still buffered.
+    """
+
+    name = "sql"
+
+    def __init__(self, leagues: dict, lessons: Iterable[dict] = (), session_factory=AsyncSessionLocal,
+                 bind=async_engine, xp_write_behind: Optional[dict] = None):
+        if session_factory is None:
+            raise RuntimeError("STORAGE_BACKEND=sql needs an async database driver (pip install asyncpg aiosqlite)")
+        self.leagues = leagues
+        self.lessons = tuple(lessons)
+        self._session_factory = session_factory
+        self._engine = bind
+        self.league_db_ids = {}  # league key -> leagues.id
+        self.league_keys = {}  # leagues.id -> league key
+        self.league_order = {}  # leagues.id -> rank_order
+        self._ready = False
+        self._init_lock = asyncio.Lock()
+        self.xp_ledger = XPLedger(
+            self._write_xp_awards, self._xp_checkpoint, **xp_write_behind
+        ) if xp_write_behind is not None else None
+
+    async def init(self):
+        if self._ready:
+            return
+        async with self._init_lock:
+            if not self._ready:
+                await self._init()
+                self._ready = True
+
+    async def _init(self):
+        await init_async_db(self._engine)
+
+        async with self._session_factory() as db:
+            ordered = sorted(self.leagues.items(), key=lambda item: item[1]['min_xp'])
+            for rank_order, (league_id, league) in enumerate(ordered, start=1):
+                row = await async_crud.get_league_by_name(db, league['name'])
+                if row is None:
+                    row = League(name=league['name'], rank_order=rank_order, min_xp=league['min_xp'])
+                    db.add(row)
+                # Rows edited in the database keep their thresholds
+                if row.promotion_threshold is None:
+                    row.promotion_threshold = league.get('promotion_threshold')
+                if row.demotion_threshold is None:
+                    row.demotion_threshold = league.get('demotion_threshold')
+                await db.flush()
+                self.league_db_ids[league_id] = row.id
+                self.league_keys[row.id] = league_id
+                self.league_order[row.id] = row.rank_order
+
+            # QuizAttempt rows reference lessons, so the curriculum needs rows too
+            existing = set(await db.scalars(select(Lesson.id)))
+            for lesson in self.lessons:
+                if lesson['id'] in existing:
+                    continue
+                db.add(Lesson(
+                    id=lesson['id'],
+                    lesson_number=lesson['id'],
+                    title=lesson['title'],
+                    level=lesson['level'],
+                    language=CURRICULUM_LANGUAGE,
+                    content={key: thaw(lesson.get(key)) for key in ("story", "vocabulary", "grammar")},
+                    quiz={"questions": thaw(lesson.get("quiz", [])), "passing_score": PASSING_SCORE}
+                ))
+            await db.commit()
+
+            # Backfill the XP aggregates and board placements once for data written before they existed
+            if await db.scalar(select(XPWeekly.user_id).limit(1)) is None and (
+                    await db.scalar(select(XPTransaction.id).limit(1)) is not None
+                    or await db.scalar(select(LeagueParticipant.id).limit(1)) is not None):
+                print(f"Rebuilt {await db.run_sync(crud.rebuild_xp_aggregates)} daily XP aggregate rows from the ledger")
+        if self.xp_ledger is not None:
+            await self.xp_ledger.open()
+
+    async def close(self):
+        if self.xp_ledger is not None:
+            try:
+                await self.xp_ledger.flush()
+            except Exception as e:
+                print(f"XP ledger flush failed on close: {e}")
+            self.xp_ledger.close()
+        await self._engine.dispose()
+
+    def start(self):
+        if self.xp_ledger is not None:
+            self.xp_ledger.start()
+
+    async def stop(self):
+        if self.xp_ledger is not None:
+            await self.xp_ledger.stop()
+
+    @asynccontextmanager
+    async def session(self):
+        """A new AsyncSession, creating tables and reference rows first if needed"""
+        await self.init()
+        async with self._session_factory() as db:
+            yield db
+
+    async def _user_id(self, db, email: str, required: bool = True) -> Optional[int]:
+        # Users are only created by create_user(); writes for an unknown email are refused
+        user = await async_crud.get_user_by_email(db, email)
+        if user is None:
+            if required:
+                raise UnknownUserError(email)
+            return None
+        return user.id
+
+    def pending_xp(self, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> int:
+        """XP awarded to a user that the write-behind ledger has not written yet"""
+        return self.xp_ledger.pending(user_id, start, end) if self.xp_ledger is not None else 0
+
+    @staticmethod
+    def _user_dict(user: User) -> dict:
+        return {
+            'email': user.email,
+            'username': user.username,
+            'target_language': user.target_language,
+            'native_language': user.native_language,
+            'level': user.assessed_level or 'beginner',
+            'interests': user.interests or [],
+            'oauth_provider': user.oauth_provider,
+            'oauth_id': user.oauth_id,
+            'picture': user.profile_image_url
+        }
+
+    async def get_user(self, email):
+        async with self.session() as db:
+            user = await async_crud.get_user_by_email(db, email)
+            return self._user_dict(user) if user is not None else None
+
+    async def find_oauth_user(self, oauth_provider, oauth_id):
+        async with self.session() as db:
+            user = await async_crud.get_user_by_oauth(db, oauth_provider, oauth_id)
+            return self._user_dict(user) if user is not None else None
+
+    async def username_exists(self, username):
+        async with self.session() as db:
+            return await async_crud.username_exists(db, username)
+
+    async def create_user(self, user_data):
+        email = user_data['email']
+        async with self.session() as db:
+            try:
+                user = await async_crud.create_user(
+                    db,
+                    email=email,
+                    username=user_data.get('username') or await async_crud.suggest_username(db, email.split('@')[0]),
+                    target_language=user_data.get('target_language') or CURRICULUM_LANGUAGE,
+                    password=user_data.get('password'),
+                    oauth_provider=user_data.get('oauth_provider'),
+                    oauth_id=user_data.get('oauth_id'),
+                    profile_image_url=user_data.get('picture'),
+                    native_language=user_data.get('native_language') or "English",
+                    assessed_level=user_data.get('level'),
+                    interests=user_data.get('interests')
+                )
+            except IntegrityError:
+                await db.rollback()
+                raise DuplicateUserError(email)
+            return self._user_dict(user)
+
+    async def get_lesson_progress(self, email):
+        async with self.session() as db:
+            user_id = await self._user_id(db, email, required=False)
+            if user_id is None:
+                return {}
+            progress = await async_crud.get_user_progress(db, user_id)
+            completed = set(progress.lessons_completed or []) if progress is not None else set()
+
+            records = {}
+            for attempt in await async_crud.get_quiz_attempts(db, user_id):
+                previous = records.get(attempt.lesson_id)
+                records[attempt.lesson_id] = {
+                    "lesson_id": attempt.lesson_id,
+                    "completed": attempt.lesson_id in completed,
+                    "score": attempt.score,
+                    "attempts": (previous["attempts"] if previous else 0) + 1,
+                    "last_attempt": attempt.completed_at.isoformat() if attempt.completed_at else None
+                }
+
+        for lesson_id in completed - records.keys():
+            records[lesson_id] = {
+                "lesson_id": lesson_id,
+                "completed": True,
+                "score": None,
+                "attempts": 0,
+                "last_attempt": None
+            }
+        return records
+
+    async def save_lesson_progress(self, email, progress, attempt=None):
+        lesson_id = progress['lesson_id']
+        async with self.session() as db:
+            user_id = await self._user_id(db, email)
+            if attempt is not None:
+                await async_crud.create_quiz_attempt(
+                    db,
+                    user_id,
+                    lesson_id,
+                    progress['score'],
+                    answers=attempt.get('answers'),
+                    xp_earned=attempt.get('xp_earned'),
+                    completed_at=_parse_time(progress.get('last_attempt')),
+                    commit=False
+                )
+
+            # The attempt and the completed list commit together
+            row = await async_crud.get_user_progress(db, user_id)
+            completed = [done for done in (row.lessons_completed or []) if done != lesson_id]
+            if progress['completed']:
+                completed.append(lesson_id)
+            await async_crud.update_user_progress(db, user_id, lessons_completed=sorted(completed))
+        return progress
+
+    async def get_xp(self, email):
+        async with self.session() as db:
+            user_id = await self._user_id(db, email, required=False)
+            if user_id is None:
+                return None
+            progress = await async_crud.get_user_progress(db, user_id)
+            participant = await async_crud.get_latest_league_participant(db, user_id)
+            pending_xp = self.pending_xp(user_id)
+            if progress is None or (participant is None and not progress.total_xp and not pending_xp):
+                return None
+
+            weekly_xp = 0
+            if participant is not None:
+                weekly_xp = await async_crud.get_weekly_xp(db, user_id, participant.week_start) + self.pending_xp(
+                    user_id, participant.week_start, participant.week_end
+                )
+            return {
+                'total_xp': (progress.total_xp or 0) + pending_xp,
+                'weekly_xp': weekly_xp,
+                'streak_days': progress.daily_streak or 0,
+                'last_active': (progress.last_activity_date or datetime.utcnow().date()).isoformat(),
+                'week': tuple(participant.week_start.isocalendar()[:2]) if participant is not None else None
+            }
+
+    async def save_xp(self, email, xp_data, amount=0, source="activity"):
+        async with self.session() as db:
+            user_id = await self._user_id(db, email)
+            if amount and self.xp_ledger is None:
+                await async_crud.add_xp(db, user_id, amount, source[:50])
+            await async_crud.update_user_progress(
+                db,
+                user_id,
+                daily_streak=xp_data['streak_days'],
+                last_activity_date=_parse_time(xp_data['last_active']).date()
+            )
+        if amount and self.xp_ledger is not None:
+            # Outside the session, so waiting out a full buffer doesn't hold a pooled connection
+            await self.xp_ledger.add(user_id, amount, source[:50])
+
+    def reserve_xp(self):
+        if self.xp_ledger is None:
+            return super().reserve_xp()
+        return self.xp_ledger.reserve()
+
+    async def xp_activity(self, email, start, end):
+        async with self.session() as db:
+            user_id = await self._user_id(db, email, required=False)
+            if user_id is None:
+                return {}
+            days = await async_crud.get_daily_xp(db, user_id, start, end)
+        if self.xp_ledger is not None:
+            for day, xp in self.xp_ledger.pending_days(user_id, start, end).items():
+                days[day] = days.get(day, 0) + xp
+        return days
+
+    # The ledger opens during init(), so these skip session() and its init wait
+    async def _write_xp_awards(self, awards, journal, last_seq):
+        async with self._session_factory() as db:
+            await async_crud.write_xp_ledger_batch(db, awards, journal, last_seq)
+
+    async def _xp_checkpoint(self, journal):
+        async with self._session_factory() as db:
+            return await async_crud.get_xp_ledger_checkpoint(db, journal)
+
+    async def update_leaderboard(self, email, xp_data, league_id):
+        week_start, week_end = week_bounds(xp_data['week'])
+        async with self.session() as db:
+            user_id = await self._user_id(db, email)
+            await async_crud.upsert_league_participant(
+                db,
+                user_id,
+                self.league_db_ids[league_id],
+                week_start,
+                week_end,
+                xp_data['weekly_xp'],
+                league_order=self.league_order
+            )
+
+    async def leaderboard(self, week):
+        await self.init()
+        return SQLLeaderboard(self, week_bounds(week)[0])
+
+    async def leaderboard_weeks(self, current_week):
+        async with self.session() as db:
+            week_starts = await db.scalars(select(LeagueParticipant.week_start).where(
+                LeagueParticipant.week_start < week_bounds(current_week)[0]
+            ).distinct().order_by(LeagueParticipant.week_start.desc()))
+        return [tuple(week_start.isocalendar()[:2]) for week_start in week_starts]
+
+    async def settle_week(self, week, force=False):
+        """Settle each league cohort of a finished week in its own transaction.
+
+        Ranks come from a window function over xp_weekly, flags and next
+        week's rows are written with one UPDATE ... FROM and one INSERT ...
+        SELECT per cohort, so nothing is loaded into Python. A cohort that
+        already has ranks is skipped unless force is set, so a crashed run
+        resumes where it stopped; rerunning a cohort gives the same result.
+        """
+        async with self.session() as db:
+            rows = (await db.scalars(select(League).where(League.id.in_(self.league_keys)))).all()
+        rules = PromotionRules({self.league_keys[row.id]: {
+            'min_xp': row.min_xp or 0,
+            'promotion_threshold': row.promotion_threshold,
+            'demotion_threshold': row.demotion_threshold
+        } for row in rows})
+
+        summary = {}
+        for league_id in rules.league_ids:
+            async with self.session() as db:
+                summary[league_id] = await self._settle_cohort(db, rules, league_id, week, force)
+        return summary
+
+    async def _settle_cohort(self, db, rules: PromotionRules, league_id: str, week: Week, force: bool) -> dict:
+        week_start, _ = week_bounds(week)
+        next_start, next_end = week_start + timedelta(days=7), week_start + timedelta(days=13)
+        league_db_id = self.league_db_ids[league_id]
+        in_cohort = and_(LeagueParticipant.week_start == week_start, LeagueParticipant.league_id == league_db_id)
+        if await db.scalar(select(LeagueParticipant.id).where(in_cohort).limit(1)) is None:
+            return await self._cohort_summary(db, in_cohort)
+        if not force and await db.scalar(
+            select(LeagueParticipant.id).where(in_cohort, LeagueParticipant.rank.is_(None)).limit(1)
+        ) is None:
+            return dict(await self._cohort_summary(db, in_cohort), skipped=True)
+
+        ranked = select(
+            LeagueParticipant.id,
+            XPWeekly.user_id,
+            XPWeekly.xp.label("weekly_xp"),
+            func.coalesce(UserProgress.total_xp, 0).label("total_xp"),
+            func.row_number().over(order_by=(XPWeekly.xp.desc(), XPWeekly.user_id)).label("rank"),
+            func.count().over().label("cohort_size")
+        ).select_from(XPWeekly).join(LeagueParticipant, and_(
+            LeagueParticipant.user_id == XPWeekly.user_id,
+            LeagueParticipant.week_start == XPWeekly.week_start
+        )).outerjoin(UserProgress, UserProgress.user_id == XPWeekly.user_id).where(
+            XPWeekly.week_start == week_start,
+            XPWeekly.league_id == league_db_id
+        ).subquery()
+
+        # PromotionRules.settle as SQL: move one league by rank, never below the total-XP floor
+        index = rules.index[league_id]
+        promoted = and_(ranked.c.rank <= rules.promote_top[league_id], ranked.c.weekly_xp > 0)
+        demoted = and_(ranked.c.rank > ranked.c.cohort_size - rules.demote_bottom[league_id], ~promoted)
+        moved = case((promoted, index + 1), (demoted, index - 1), else_=index)
+        floor = case(
+            *[(ranked.c.total_xp >= min_xp, i) for i, min_xp in reversed(list(enumerate(rules.thresholds)))],
+            else_=0
+        )
+        next_index = case((moved >= floor, moved), else_=floor)
+
+        await db.execute(
+            update(LeagueParticipant)
+            .where(LeagueParticipant.id == ranked.c.id)
+            .values(
+                weekly_xp=ranked.c.weekly_xp,
+                rank=ranked.c.rank,
+                promoted=next_index > index,
+                demoted=next_index < index
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        # Next week's rows; a row the user already created this week keeps the higher league
+        next_league = case({i: self.league_db_ids[key] for i, key in enumerate(rules.league_ids)}, value=next_index)
+        carry_over = crud.upsert_insert(self._engine.dialect.name, LeagueParticipant).from_select(
+            ["user_id", "league_id", "week_start", "week_end", "weekly_xp"],
+            select(
+                ranked.c.user_id, next_league, literal(next_start, Date), literal(next_end, Date), literal(0)
+            ).where(ranked.c.user_id.isnot(None))  # SQLite needs a WHERE before ON CONFLICT
+        )
+        order = case(self.league_order, value=LeagueParticipant.league_id)
+        excluded_order = case(self.league_order, value=carry_over.excluded.league_id)
+        await db.execute(carry_over.on_conflict_do_update(
+            index_elements=["user_id", "week_start"],
+            set_={"league_id": case((excluded_order > order, carry_over.excluded.league_id), else_=LeagueParticipant.league_id)}
+        ))
+        await db.execute(crud.mirror_league_placements(
+            self._engine.dialect.name,
+            LeagueParticipant.week_start == next_start,
+            LeagueParticipant.user_id.in_(select(ranked.c.user_id))
+        ))
+        await db.commit()
+        return await self._cohort_summary(db, in_cohort)
+
+    @staticmethod
+    async def _cohort_summary(db, in_cohort) -> dict:
+        participants, promoted, demoted = (await db.execute(select(
+            func.count(LeagueParticipant.id),
+            func.sum(case((LeagueParticipant.promoted, 1), else_=0)),
+            func.sum(case((LeagueParticipant.demoted, 1), else_=0))
+        ).where(in_cohort))).one()
+        return {"participants": participants, "promoted": promoted or 0, "demoted": demoted or 0}
+
+    def get_stats(self):
+        stats = {"backend": self.name, "dialect": self._engine.dialect.name, "engines": get_engine_stats()}
+        if self.xp_ledger is not None:
+            stats["xp_ledger"] = self.xp_ledger.get_stats()
+        return stats
@@ -0,0 +1,145 @@
+"""
+Static cache service
+Static files held in memory as prepared payloads, optionally reloaded when they change on disk
+"""
+
+import asyncio
+import mimetypes
+import os
+from email.utils import formatdate
+from typing import Dict, Optional, Set, Tuple
+
+from services.prepared_response import PreparedPayload
+
+# Media types worth gzip/brotli; images and fonts are already compressed
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml")
+
+
+class StaticCache:
+    """Every file under a directory, read once and served from memory.
+
+    Each file becomes a PreparedPayload with its ETag, Last-Modified and
+    precompressed variants. Files larger than max_file_bytes (big images)
+    are only listed: is_on_disk() tells the caller to stream them from disk
+    instead. Files under immutable_prefix get a long-lived Cache-Control;
+    everything else must revalidate. Nothing is read until load(), so the
+    app does it at startup; with watch enabled a background task polls file
+    mtimes and reloads whatever changed, for development.
+    """
+
+    def __init__(self, directory: str, immutable_prefix: str = "assets/",
+                 immutable_max_age: int = 31536000, watch: bool = False,
+                 poll_interval: float = 1.0, max_file_bytes: int = 256 * 1024):
+        self.directory = directory
+        self.immutable_prefix = immutable_prefix
+        self.immutable_max_age = immutable_max_age
+        self.watch = watch
+        self.poll_interval = poll_interval
+        self.max_file_bytes = max_file_bytes
+        self._files: Dict[str, PreparedPayload] = {}  # relative posix path -> payload
+        self._on_disk: Set[str] = set()  # relative posix paths too large to hold in memory
+        self._mtimes: Dict[str, int] = {}  # relative posix path -> st_mtime_ns
+        self._watcher: Optional[asyncio.Task] = None
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+    def _scan(self) -> Dict[str, Tuple[str, int, int]]:
+        found = {}
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                full_path = os.path.join(root, name)
+                relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                stat = os.stat(full_path)
+                found[relative] = (full_path, stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def cache_control(self, relative: str) -> str:
+        """Cache-Control for a path relative to the directory"""
+        if relative.lstrip("/").startswith(self.immutable_prefix):
+            return f"public, max-age={self.immutable_max_age}, immutable"
+        return "no-cache"
+
+    def _prepare(self, relative: str, full_path: str, mtime_ns: int) -> PreparedPayload:
+        with open(full_path, "rb") as f:
+            body = f.read()
+        media_type = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+        return PreparedPayload(
+            body,
+            media_type,
+            cache_control=self.cache_control(relative),
+            last_modified=formatdate(mtime_ns / 1e9, usegmt=True),
+            compress=media_type.startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def load(self) -> int:
+        """Read new or changed files and drop deleted ones; returns how many changed"""
+        found = self._scan()
+        loaded = 0
+        for relative, (full_path, mtime_ns, size) in found.items():
+            if self._mtimes.get(relative) == mtime_ns:
+                continue
+            if size > self.max_file_bytes:
+                self._files.pop(relative, None)
+                self._on_disk.add(relative)
+                self._mtimes[relative] = mtime_ns
+                loaded += 1
+                continue
+            try:
+                self._files[relative] = self._prepare(relative, full_path, mtime_ns)
+            except OSError as e:
+                print(f"Static cache could not read {full_path}: {e}")
+                continue
+            self._on_disk.discard(relative)
+            self._mtimes[relative] = mtime_ns
+            loaded += 1
+        for relative in set(self._mtimes) - set(found):
+            self._files.pop(relative, None)
+            self._on_disk.discard(relative)
+            del self._mtimes[relative]
+            loaded += 1
+        return loaded
+
+    def get(self, path: str) -> Optional[PreparedPayload]:
+        """Payload for a path relative to the directory, or None"""
+        payload = self._files.get(path.lstrip("/"))
+        self._stats["hits" if payload is not None else "misses"] += 1
+        return payload
+
+    def is_on_disk(self, path: str) -> bool:
+        """Whether a path exists but is too large to be held in memory"""
+        return path.lstrip("/") in self._on_disk
+
+    def start(self):
+        """Start the mtime watcher on the running event loop if watching is enabled"""
+        if self.watch and self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        """Cancel the mtime watcher"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if await asyncio.to_thread(self.load):
+                    self._stats["reloads"] += 1
+            except Exception as e:
+                print(f"Static cache reload failed: {e}")
+
+    def get_stats(self) -> dict:
+        """Hit/miss counters and cached size"""
+        return {
+            **self._stats,
+            "files": len(self._files),
+            "on_disk": len(self._on_disk),
+            "bytes": sum(len(payload.body) for payload in self._files.values()),
+            "watching": self._watcher is not None
+        }
@@ -0,0 +1,381 @@
+"""
+Storage service
+Users, lesson progress, XP and weekly leaderboards behind one interface with pluggable backends
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.leaderboard import LeagueLeaderboard
+from services.promotions import PromotionRules
+
+Week = Tuple[int, int]  # (iso_year, iso_week)
+
+
+class DuplicateUserError(Exception):
+    """Raised when an email or username is already registered"""
+
+
+class UnknownUserError(Exception):
+    """Raised when progress or XP is written for an email that was never registered"""
+
+
+class BoardView:
+    """Async read API over an in-memory Leaderboard or LeagueLeaderboard.
+
+    Matches SQLLeaderboard, so handlers read every backend's boards the
+    same way: top, rank, around, count, league_of and partition. placement
+    answers league_of for users who are not on the board yet.
+    """
+
+    def __init__(self, board, placement: Optional[Callable[[str], Optional[str]]] = None):
+        self._board = board
+        self._placement = placement
+
+    @property
+    def frozen(self):
+        return self._board.frozen
+
+    def partition(self, league_id: str) -> "BoardView":
+        """Leaderboard of a single league"""
+        return BoardView(self._board.partition(league_id))
+
+    async def count(self) -> int:
+        """Number of ranked users"""
+        return len(self._board)
+
+    async def league_of(self, email: str) -> Optional[str]:
+        """League a user is placed in this week"""
+        league_id = self._board.league_of(email)
+        if league_id is None and self._placement is not None:
+            return self._placement(email)
+        return league_id
+
+    async def rank(self, email: str) -> Optional[int]:
+        """1-based rank of a user, or None if not ranked"""
+        return self._board.rank(email)
+
+    async def top(self, limit: int) -> List[dict]:
+        """Top N rows"""
+        return self._board.top(limit)
+
+    async def around(self, email: str, radius: int) -> List[dict]:
+        """Rows within radius places of a user, each tagged with its rank"""
+        return self._board.around(email, radius)
+
+
+class Storage:
+    """Interface shared by every storage backend.
+
+    Every data method is a coroutine, so a backend that waits on a database
+    never holds up the event loop. User records are plain dicts (email,
+    username, target_language, ...). XP records are dicts with total_xp,
+    weekly_xp, streak_days, last_active and week; callers apply XP rules and
+    hand the updated record back with save_xp(). Only create_user() adds
+    users: writing progress, XP or a leaderboard row for an email that was
+    never registered raises UnknownUserError. leaderboard(week) returns
+    a board with BoardView's async read API (top, rank, around, count,
+    league_of, partition). A user's league for a week only moves up until
+    settle_week() closes it.
+    """
+
+    name = "base"
+
+    async def init(self):
+        """Prepare the backend (create tables, seed reference data)"""
+
+    async def close(self):
+        """Release connections"""
+
+    def start(self):
+        """Start background work on the running event loop"""
+
+    async def stop(self):
+        """Stop background work, writing out anything buffered"""
+
+    # Users
+    async def get_user(self, email: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find_oauth_user(self, oauth_provider: str, oauth_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def username_exists(self, username: str) -> bool:
+        raise NotImplementedError
+
+    async def create_user(self, user_data: dict) -> dict:
+        raise NotImplementedError
+
+    # Lesson progress
+    async def get_lesson_progress(self, email: str) -> Dict[int, dict]:
+        raise NotImplementedError
+
+    async def save_lesson_progress(self, email: str, progress: dict, attempt: Optional[dict] = None) -> dict:
+        raise NotImplementedError
+
+    # XP
+    async def get_xp(self, email: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def save_xp(self, email: str, xp_data: dict, amount: int = 0, source: str = "activity"):
+        raise NotImplementedError
+
+    async def xp_activity(self, email: str, start: date, end: date) -> Dict[date, int]:
+        """XP per UTC day between start and end (inclusive); days without XP are left out"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def reserve_xp(self):
+        """Context in which the next save_xp() award is sure to be accepted.
+
+        A backend that can refuse awards (XPLedgerFull) raises on entry, so
+        callers find out before writing attempts, progress or streaks.
+        """
+        yield
+
+    # Weekly leaderboards
+    async def update_leaderboard(self, email: str, xp_data: dict, league_id: str):
+        raise NotImplementedError
+
+    async def leaderboard(self, week: Week):
+        raise NotImplementedError
+
+    async def leaderboard_weeks(self, current_week: Week) -> List[Week]:
+        raise NotImplementedError
+
+    async def settle_week(self, week: Week, force: bool = False) -> Dict[str, dict]:
+        """Rank a finished week's cohorts, flag promotions and demotions and place users for the next week"""
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        """Backend name and sizes"""
+        return {"backend": self.name}
+
+
+class MemoryStorage(Storage):
+    """Process-local dicts; state is lost on restart and not shared between workers.
+
+    The current week's board is a LeagueLeaderboard; when a later week is
+    requested it is frozen into history, keeping the last history_weeks
+    weeks. With promotion_rules nobody is moved at that point: a user's
+    league for the new week comes from their rank on last week's frozen
+    board when they are first looked up or earn XP, and settle_week()
+    ranks the finished board on a worker thread in the background, so a
+    rollover costs the same with any number of users. Its promoted/demoted
+    flags are stamped back on the event loop in one pass, so readers never
+    see a half-settled cohort; stop() waits for a settlement in progress.
+    """
+
+    name = "memory"
+
+    def __init__(self, league_ids: Iterable[str], history_weeks: int = 12,
+                 promotion_rules: Optional[PromotionRules] = None):
+        self.league_ids = tuple(league_ids)
+        self.history_weeks = history_weeks
+        self.promotion_rules = promotion_rules
+        self._users: Dict[str, dict] = {}  # email -> user record
+        self._usernames = set()
+        self._oauth: Dict[tuple, str] = {}  # (provider, oauth_id) -> email
+        self._progress: Dict[str, Dict[int, dict]] = {}  # email -> {lesson_id: progress}
+        self._xp: Dict[str, dict] = {}  # email -> XP record
+        self._daily_xp: Dict[str, Dict[date, int]] = {}  # email -> {UTC day: XP}
+        self._week: Optional[Week] = None
+        self._board = LeagueLeaderboard(self.league_ids)
+        self._history: Dict[Week, LeagueLeaderboard] = {}  # week -> frozen board
+        self._settled = set()  # weeks whose results are final
+        self._settling: Set[asyncio.Task] = set()  # background settle_week() runs
+
+    async def get_user(self, email):
+        return self._users.get(email)
+
+    async def find_oauth_user(self, oauth_provider, oauth_id):
+        email = self._oauth.get((oauth_provider, oauth_id))
+        return self._users.get(email) if email is not None else None
+
+    async def username_exists(self, username):
+        return username in self._usernames
+
+    async def create_user(self, user_data):
+        email, username = user_data['email'], user_data.get('username')
+        if email in self._users or (username and username in self._usernames):
+            raise DuplicateUserError(email)
+        if username:
+            self._usernames.add(username)
+        if user_data.get('oauth_provider') and user_data.get('oauth_id'):
+            self._oauth[(user_data['oauth_provider'], user_data['oauth_id'])] = email
+        self._users[email] = user_data
+        return user_data
+
+    def _require_user(self, email: str):
+        if email not in self._users:
+            raise UnknownUserError(email)
+
+    async def get_lesson_progress(self, email):
+        # Copies, so callers can't change stored progress without save_lesson_progress()
+        return {lesson_id: dict(record) for lesson_id, record in self._progress.get(email, {}).items()}
+
+    async def save_lesson_progress(self, email, progress, attempt=None):
+        self._require_user(email)
+        self._progress.setdefault(email, {})[progress['lesson_id']] = dict(progress)
+        return progress
+
+    async def get_xp(self, email):
+        return self._xp.get(email)
+
+    async def save_xp(self, email, xp_data, amount=0, source="activity"):
+        self._require_user(email)
+        self._xp[email] = xp_data
+        if amount:
+            days = self._daily_xp.setdefault(email, {})
+            today = datetime.utcnow().date()
+            days[today] = days.get(today, 0) + amount
+
+    async def xp_activity(self, email, start, end):
+        return {day: xp for day, xp in self._daily_xp.get(email, {}).items() if start <= day <= end}
+
+    async def update_leaderboard(self, email, xp_data, league_id):
+        self._require_user(email)
+        board = self._board_for(xp_data['week'])
+        if board is None or board.frozen:
+            return
+        username = self._users[email].get('username') or email.split('@')[0]
+        placed = board.league_of(email) or self._carried_league(email)
+        if placed is not None and self._league_index(placed) > self._league_index(league_id):
+            league_id = placed  # Keep a promotion for the rest of the week
+        board.update(email, {
+            'email': email,
+            'username': username,
+            'weekly_xp': xp_data['weekly_xp'],
+            'total_xp': xp_data['total_xp'],
+            'league': league_id,
+            'streak_days': xp_data['streak_days'],
+            'promoted': False,
+            'demoted': False
+        })
+
+    def _league_index(self, league_id: str) -> int:
+        if self.promotion_rules is not None:
+            return self.promotion_rules.index[league_id]
+        return self.league_ids.index(league_id)
+
+    def _carried_league(self, email: str) -> Optional[str]:
+        """League a user's result on last week's board earns them this week"""
+        previous = self._history.get(_previous_week(self._week)) if self.promotion_rules is not None else None
+        league_id = previous.league_of(email) if previous is not None else None
+        if league_id is None:
+            return None
+        cohort = previous.partition(league_id)
+        row = cohort.get(email)
+        next_index = self.promotion_rules.place(
+            league_id, cohort.rank(email), len(cohort), row['weekly_xp'], row['total_xp']
+        )
+        return self.promotion_rules.league_ids[next_index]
+
+    async def leaderboard(self, week):
+        board = self._board_for(week)
+        if board is None:
+            return None
+        return BoardView(board, self._carried_league if board is self._board else None)
+
+    def _board_for(self, week: Week) -> Optional[LeagueLeaderboard]:
+        if self._week is None:
+            self._week = week
+        if week == self._week:
+            return self._board
+        if week < self._week:
+            return self._history.get(week)
+
+        # A new week: archive the finished board and start an empty one; users carry over on first touch
+        finished_week = self._week
+        self._history[finished_week] = self._board.freeze()
+        while len(self._history) > self.history_weeks:
+            oldest = min(self._history)
+            del self._history[oldest]
+            self._settled.discard(oldest)
+        self._board = LeagueLeaderboard(self.league_ids)
+        self._week = week
+        if self.promotion_rules is not None:
+            task = asyncio.get_running_loop().create_task(self.settle_week(finished_week))
+            self._settling.add(task)
+            task.add_done_callback(self._settle_done)
+        return self._board
+
+    def _settle_done(self, task: asyncio.Task):
+        self._settling.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Settling the finished week failed: {task.exception()}")
+
+    async def stop(self):
+        """Wait for a background settlement to finish"""
+        if self._settling:
+            await asyncio.gather(*self._settling, return_exceptions=True)  # failures are reported by _settle_done
+
+    async def settle_week(self, week, force=False):
+        board = self._history.get(week)
+        if self.promotion_rules is None or board is None or (week in self._settled and not force):
+            return {}
+
+        # Rank off the event loop (the board is frozen), then stamp every flag at once on it
+        flags, summary = await asyncio.to_thread(self._settle, board)
+        for row, promoted, demoted in flags:
+            row['promoted'] = promoted
+            row['demoted'] = demoted
+        self._settled.add(week)
+        return summary
+
+    def _settle(self, board: LeagueLeaderboard) -> Tuple[List[tuple], Dict[str, dict]]:
+        """(row, promoted, demoted) for every row of a frozen board, and a per-league summary"""
+        # Each partition is already in rank order, so a cohort settles in one vectorized pass
+        rules = self.promotion_rules
+        flags, summary = [], {}
+        for league_id in rules.league_ids:
+            rows = list(board.partition(league_id).iter_ranked())
+            next_indexes = rules.settle(
+                league_id, [row['weekly_xp'] for row in rows], [row['total_xp'] for row in rows]
+            )
+            index = rules.index[league_id]
+            promoted = demoted = 0
+            for row, next_index in zip(rows, next_indexes):
+                flags.append((row, next_index > index, next_index < index))
+                promoted += next_index > index
+                demoted += next_index < index
+            summary[league_id] = {
+                "participants": len(rows),
+                "promoted": promoted,
+                "demoted": demoted
+            }
+        return flags, summary
+
+    async def leaderboard_weeks(self, current_week):
+        self._board_for(current_week)
+        return sorted(self._history, reverse=True)
+
+    def get_stats(self):
+        return {
+            "backend": self.name,
+            "users": len(self._users),
+            "xp_records": len(self._xp),
+            "archived_weeks": len(self._history)
+        }
+
+
+def _previous_week(week: Week) -> Week:
+    return tuple((date.fromisocalendar(week[0], week[1], 1) - timedelta(days=7)).isocalendar()[:2])
+
+
+def create_storage(backend: str, leagues: dict, lessons: Iterable[dict] = (), history_weeks: int = 12,
+                   xp_write_behind: Optional[dict] = None) -> Storage:
+    """Build the backend named by STORAGE_BACKEND ('memory' or 'sql').
+
+    xp_write_behind holds XPLedger options for the sql backend; None writes
+    each XP award synchronously.
+    """
+    backend = (backend or "memory").strip().lower()
+    if backend == "memory":
+        return MemoryStorage(leagues.keys(), history_weeks=history_weeks, promotion_rules=PromotionRules(leagues))
+    if backend == "sql":
+        from services.sql_storage import SQLStorage
+        return SQLStorage(leagues, lessons, xp_write_behind=xp_write_behind)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,210 @@
+"""
+Story pool service
+Pre-generated stories per (language, level, topic) bucket, refilled in the background
+"""
+
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+BucketKey = Tuple[str, str, str]
+
+# The interests offered in the app; anything else shares the general bucket
+STORY_TOPICS = ("travel", "food", "sports", "technology", "music", "movies", "history", "nature")
+GENERAL_TOPIC = "general"
+
+
+def story_topic(interests: List[str]) -> str:
+    """The first of a learner's interests that has a bucket, or the general one"""
+    for interest in interests:
+        if interest.strip().lower() in STORY_TOPICS:
+            return interest.strip().lower()
+    return GENERAL_TOPIC
+
+
+def bucket_key(target_language: str, level: str, interests: List[str]) -> BucketKey:
+    """Normalize a story request into its pool bucket"""
+    return (target_language.strip().lower(), level.strip().lower(), story_topic(interests))
+
+
+def bucket_interests(interests: List[str]) -> List[str]:
+    """The interests a bucket's stories are generated with, so any of its learners can be served them"""
+    topic = story_topic(interests)
+    return [] if topic == GENERAL_TOPIC else [topic]
+
+
+class StoryPool:
+    """Background-filled pool of generated stories.
+
+    Interests map onto a fixed set of topics (STORY_TOPICS), so buckets
+    stay few and shared. Each story can be served to several learners but
+    never twice to the same user, and is retired after max_serves. Once a
+    bucket has been asked for min_demand times, a worker keeps it topped
+    up to target_size whenever it drops below low_watermark; until then,
+    and whenever a bucket has nothing left for a user, take() returns None
+    so the caller generates live. Only the max_buckets most recently used
+    buckets are kept.
+
+    Seen-story ids are only kept for stories still in the pool, so the
+    per-user sets shrink as stories are retired or evicted. Calls without
+    a user_id (anonymous learners) can't be told apart and get no dedupe.
+    """
+
+    def __init__(self, generate: Callable[[str, str, List[str]], Awaitable[dict]],
+                 low_watermark: int = 3, target_size: int = 8, max_serves: int = 20,
+                 max_buckets: int = 256, min_demand: int = 2):
+        self._generate = generate
+        self.low_watermark = low_watermark
+        self.target_size = target_size
+        self.max_serves = max_serves
+        self.max_buckets = max(max_buckets, 1)
+        self.min_demand = min_demand
+        self._buckets: "OrderedDict[BucketKey, deque]" = OrderedDict()  # key -> deque of [story_id, story, serves, seen_by], LRU first
+        self._stories: Dict[int, list] = {}  # story_id -> its bucket entry, while pooled
+        self._requests: Dict[BucketKey, tuple] = {}  # key -> (language, level, interests) to generate with
+        self._demand: Dict[BucketKey, int] = {}  # key -> take() calls
+        self._seen: Dict[str, Set[int]] = {}  # user_id -> story ids already served
+        self._ids = itertools.count(1)
+        self._pending: Set[BucketKey] = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stats = {"pool_hits": 0, "pool_misses": 0, "generated": 0, "refill_errors": 0, "evicted_buckets": 0}
+
+    def start(self):
+        """Start the refill worker on the running event loop"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._refill_worker())
+
+    async def stop(self):
+        """Cancel the refill worker"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def add(self, target_language: str, level: str, interests: List[str], story: dict,
+            seen_by: Optional[str] = None) -> int:
+        """Put a story into its bucket, optionally marking it as seen by a user; returns its id"""
+        story_id = next(self._ids)
+        bucket = self._bucket(target_language, level, interests)
+        entry = [story_id, story, 0 if seen_by is None else 1, set()]
+        bucket.append(entry)
+        self._stories[story_id] = entry
+        while len(bucket) > self.target_size * 2:
+            self._retire(bucket.popleft())
+        if seen_by is not None:
+            self.mark_seen(story_id, seen_by)
+        return story_id
+
+    def mark_seen(self, story_id: int, user_id: Optional[str]) -> bool:
+        """Record that a user has read a story so the pool never serves it to them.
+
+        Returns False if the pool already served it to this user.
+        """
+        entry = self._stories.get(story_id)
+        if user_id is None or entry is None:
+            return True
+        if user_id in entry[3]:
+            return False
+        entry[3].add(user_id)
+        self._seen.setdefault(user_id, set()).add(story_id)
+        return True
+
+    def _bucket(self, target_language: str, level: str, interests: List[str]) -> deque:
+        # The bucket for a request, marked most recently used; evicts the coldest beyond max_buckets
+        key = bucket_key(target_language, level, interests)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = deque()
+            self._requests[key] = (target_language, level, bucket_interests(interests))
+            while len(self._buckets) > self.max_buckets:
+                cold_key, cold = self._buckets.popitem(last=False)
+                for entry in cold:
+                    self._retire(entry)
+                self._requests.pop(cold_key, None)
+                self._demand.pop(cold_key, None)
+                self._stats["evicted_buckets"] += 1
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _retire(self, entry: list):
+        # The story can't be served again, so nobody needs to remember seeing it
+        story_id, _, _, seen_by = entry
+        self._stories.pop(story_id, None)
+        for user_id in seen_by:
+            seen = self._seen.get(user_id)
+            if seen is not None:
+                seen.discard(story_id)
+                if not seen:
+                    del self._seen[user_id]
+
+    def take(self, target_language: str, level: str, interests: List[str],
+             user_id: Optional[str] = None) -> Optional[dict]:
+        """Serve a pooled story this user has not seen, or None if the bucket is cold"""
+        key = bucket_key(target_language, level, interests)
+        bucket = self._bucket(target_language, level, interests)
+        self._demand[key] = self._demand.get(key, 0) + 1
+        seen = self._seen.get(user_id, ()) if user_id is not None else ()
+
+        story = None
+        for entry in bucket:
+            story_id, candidate, serves, _ = entry
+            if story_id in seen:
+                continue
+            entry[2] = serves + 1
+            self.mark_seen(story_id, user_id)
+            if entry[2] >= self.max_serves:
+                bucket.remove(entry)
+                self._retire(entry)
+            story = dict(candidate)
+            break
+
+        # One-off interest combinations are served live; only buckets asked for again get prefilled
+        if self._demand[key] >= self.min_demand and (
+                len(bucket) < self.low_watermark or (story is None and len(bucket) < self.target_size)):
+            self._schedule_refill(key)
+
+        self._stats["pool_hits" if story is not None else "pool_misses"] += 1
+        return story
+
+    def _schedule_refill(self, key: BucketKey):
+        if self._queue is not None and key not in self._pending:
+            self._pending.add(key)
+            self._queue.put_nowait(key)
+
+    async def _refill_worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                if key not in self._buckets:
+                    continue  # evicted while queued
+                language, level, interests = self._requests[key]
+                bucket = self._buckets[key]
+                while len(bucket) < self.target_size and self._buckets.get(key) is bucket:
+                    story = await self._generate(language, level, interests)
+                    self.add(language, level, interests, story)
+                    self._stats["generated"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["refill_errors"] += 1
+                print(f"Story pool refill failed for {key}: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._pending.discard(key)
+
+    def get_stats(self) -> dict:
+        """Pool hit/miss counters and size"""
+        return {
+            **self._stats,
+            "buckets": len(self._buckets),
+            "stories": len(self._stories),
+            "tracked_users": len(self._seen),
+            "refills_pending": len(self._pending)
+        }
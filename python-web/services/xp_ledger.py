@@ -0,0 +1,321 @@
+"""
+XP ledger service
+Write-behind buffer that acknowledges XP awards at once and writes them to the database in bulk
+"""
+
+import asyncio
+import json
+import os
+import socket
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# Journal slots are claimed with an advisory lock where the platform has one
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+MAX_JOURNAL_SLOTS = 64
+
+
+class XPLedgerFull(Exception):
+    """Raised by add() when the buffer is full and cannot be flushed"""
+
+
+class XPLedger:
+    """Buffers XP awards and writes them in batches.
+
+    Everything runs on the event loop: add() records an award and returns
+    at once; pending() lets reads include awards that are not written yet.
+    A background task flushes every flush_interval_ms, or sooner once
+    batch_rows awards are waiting. Once max_pending awards are waiting,
+    add() awaits a flush before accepting another, so producers slow to the
+    database's pace instead of growing the buffer without bound, and raises
+    XPLedgerFull if that flush fails. A caller that must not write anything
+    else unless its award will be accepted enters reserve() first: the room
+    is held for it, so XPLedgerFull is raised up front instead.
+
+    With a journal_path every award is appended to a local journal before
+    add() returns. The coroutine write(awards, journal, last_seq) must commit
+    a batch and the journal's last written sequence number together, and
+    checkpoint(journal) returns that number, so open() after a crash replays
+    exactly the awards that never reached the database. Each process claims
+    the first unlocked slot (path, path.1, ...) so workers never share one.
+    """
+
+    def __init__(self, write: Callable[[List[dict], Optional[str], Optional[int]], Awaitable[object]],
+                 checkpoint: Callable[[str], Awaitable[int]], flush_interval_ms: float = 200,
+                 batch_rows: int = 500, max_pending: int = 10000, journal_path: Optional[str] = None):
+        self._write = write
+        self._checkpoint = checkpoint
+        self.flush_interval = max(flush_interval_ms, 1) / 1000
+        self.batch_rows = max(batch_rows, 1)
+        self.max_pending = max(max_pending, self.batch_rows)
+        self.journal_path = journal_path or None
+        self.journal_name: Optional[str] = None  # checkpoint key: host and claimed journal path
+        self._journal = None
+        self._journal_lock = None
+        self._pending: List[dict] = []
+        self._pending_by_user: Dict[int, Dict[date, int]] = {}  # user_id -> {UTC day: XP not yet written}
+        self._reserved = 0  # room held for add() calls inside reserve()
+        self._reservation: ContextVar[Optional[dict]] = ContextVar(f"xp_reservation_{id(self)}", default=None)
+        self._seq = 0
+        self._flush_lock = asyncio.Lock()  # one flush at a time
+        self._wake: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._opened = False
+        self._stats = {"awards": 0, "written": 0, "flushes": 0, "backpressure_waits": 0,
+                       "flush_errors": 0, "recovered": 0}
+
+    async def open(self):
+        """Claim a journal slot and reload awards that were never written"""
+        if self._opened or self.journal_path is None:
+            self._opened = True
+            return
+
+        path, self._journal_lock = self._claim_slot(self.journal_path)
+        self.journal_name = f"{socket.gethostname()}:{os.path.abspath(path)}"[:255]
+        last_seq = await self._checkpoint(self.journal_name)
+        self._seq = last_seq
+
+        for award in await asyncio.to_thread(self._read_journal, path):
+            self._seq = max(self._seq, award["seq"])
+            if award["seq"] > last_seq:
+                award["created_at"] = datetime.fromisoformat(award["created_at"])
+                self._buffer(award)
+                self._stats["recovered"] += 1
+
+        self._journal = open(path, "a", encoding="utf-8")
+        await self._compact()
+        self._opened = True
+        if self._stats["recovered"]:
+            print(f"XP ledger recovered {self._stats['recovered']} unwritten awards from {path}")
+
+    @staticmethod
+    def _claim_slot(path: str):
+        for slot in range(MAX_JOURNAL_SLOTS):
+            candidate = path if slot == 0 else f"{path}.{slot}"
+            lock = open(f"{candidate}.lock", "a")
+            if not FCNTL_AVAILABLE:
+                return candidate, lock
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock.close()
+                continue
+            return candidate, lock
+        raise RuntimeError(f"All {MAX_JOURNAL_SLOTS} XP journal slots for {path} are in use")
+
+    @staticmethod
+    def _read_journal(path: str) -> List[dict]:
+        awards = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        awards.append(json.loads(line))
+                    except ValueError:
+                        continue  # a write torn by the crash
+        return awards
+
+    def _buffer(self, award: dict):
+        self._pending.append(award)
+        days = self._pending_by_user.setdefault(award["user_id"], {})
+        day = award["created_at"].date()
+        days[day] = days.get(day, 0) + award["amount"]
+
+    async def _compact(self):
+        # Rewrite the journal with just the pending awards; caller holds _flush_lock or is opening
+        path = self._journal.name
+        snapshot = list(self._pending)
+        await asyncio.to_thread(self._write_journal, f"{path}.tmp", snapshot)
+
+        # Only add() ran meanwhile, so anything past the snapshot was journaled since
+        with open(f"{path}.tmp", "a", encoding="utf-8") as tmp:
+            for award in self._pending[len(snapshot):]:
+                tmp.write(self._encode(award))
+        os.replace(f"{path}.tmp", path)
+        self._journal.close()
+        self._journal = open(path, "a", encoding="utf-8")
+
+    @classmethod
+    def _write_journal(cls, path: str, awards: List[dict]):
+        with open(path, "w", encoding="utf-8") as tmp:
+            for award in awards:
+                tmp.write(cls._encode(award))
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+    @staticmethod
+    def _encode(award: dict) -> str:
+        return json.dumps(dict(award, created_at=award["created_at"].isoformat())) + "\n"
+
+    async def _make_room(self):
+        # Room counts awards held by reserve() as well as buffered ones
+        if len(self._pending) + self._reserved < self.max_pending:
+            return
+        self._stats["backpressure_waits"] += 1
+        async with self._flush_lock:
+            # Whoever held the lock may have drained the buffer already
+            if len(self._pending) + self._reserved >= self.max_pending:
+                try:
+                    await self._drain()
+                except Exception as e:
+                    raise XPLedgerFull(f"{len(self._pending)} XP awards waiting and the flush failed: {e}") from e
+            if self._reserved >= self.max_pending:
+                raise XPLedgerFull(f"{self._reserved} XP awards are already reserved")
+
+    @asynccontextmanager
+    async def reserve(self):
+        """Hold room for the next add() in this context.
+
+        Raises XPLedgerFull on entry, before the caller has written anything,
+        if the buffer is full and cannot be flushed; the add() inside then
+        neither waits nor raises for lack of room. Nested reserve() blocks
+        share the outer reservation.
+        """
+        if self._reservation.get() is not None:
+            yield
+            return
+        await self.open()
+        await self._make_room()
+        self._reserved += 1
+        reservation = {"used": False}
+        token = self._reservation.set(reservation)
+        try:
+            yield
+        finally:
+            self._reservation.reset(token)
+            if not reservation["used"]:
+                self._reserved -= 1
+
+    async def add(self, user_id: int, amount: int, source: str, source_id: int = None, description: str = None):
+        """Buffer an award; waits for a flush first if the buffer is full, unless room was reserved"""
+        await self.open()
+        reservation = self._reservation.get()
+        if reservation is not None and not reservation["used"]:
+            reservation["used"] = True
+            self._reserved -= 1
+        else:
+            await self._make_room()
+
+        self._seq += 1
+        award = {
+            "seq": self._seq,
+            "user_id": user_id,
+            "amount": amount,
+            "source": source,
+            "source_id": source_id,
+            "description": description,
+            "created_at": datetime.utcnow()
+        }
+        if self._journal is not None:
+            self._journal.write(self._encode(award))
+            self._journal.flush()  # in the OS page cache, so it survives a process crash
+        self._buffer(award)
+        self._stats["awards"] += 1
+
+        if len(self._pending) >= self.batch_rows and self._wake is not None:
+            self._wake.set()
+
+    def pending(self, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> int:
+        """XP awarded to a user that has not been written yet, optionally only between two days"""
+        return sum(self.pending_days(user_id, start, end).values())
+
+    def pending_days(self, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> Dict[date, int]:
+        """{UTC day: unwritten XP} for a user"""
+        days = self._pending_by_user.get(user_id, {})
+        return {day: xp for day, xp in days.items()
+                if (start is None or day >= start) and (end is None or day <= end)}
+
+    async def flush(self) -> int:
+        """Write the awards buffered so far in batches; returns how many were written"""
+        async with self._flush_lock:
+            return await self._drain()
+
+    async def _drain(self) -> int:
+        # Caller holds _flush_lock. Only what is buffered now, so steady traffic can't keep one flush running forever
+        written = 0
+        backlog = len(self._pending)
+        while written < backlog:
+            batch = self._pending[:min(self.batch_rows, backlog - written)]
+            try:
+                await self._write(batch, self.journal_name, batch[-1]["seq"] if self.journal_name else None)
+            except Exception:
+                self._stats["flush_errors"] += 1
+                raise
+
+            del self._pending[:len(batch)]
+            for award in batch:
+                days = self._pending_by_user[award["user_id"]]
+                day = award["created_at"].date()
+                days[day] -= award["amount"]
+                if not days[day]:
+                    del days[day]
+                if not days:
+                    del self._pending_by_user[award["user_id"]]
+            written += len(batch)
+            self._stats["written"] += len(batch)
+            self._stats["flushes"] += 1
+
+        # Replay skips anything at or below the checkpoint, so this only bounds the file size
+        if written and self._journal is not None:
+            await self._compact()
+        return written
+
+    def start(self):
+        """Start the periodic flusher on the running event loop"""
+        if self._worker is None:
+            self._wake = asyncio.Event()
+            self._worker = asyncio.create_task(self._flush_worker())
+
+    async def stop(self):
+        """Cancel the flusher and write whatever is still buffered"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            self._wake = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"XP ledger flush failed on shutdown: {e}")
+
+    async def _flush_worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"XP ledger flush failed, retrying: {e}")
+
+    def close(self):
+        """Release the journal; unwritten awards stay in it for the next open()"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._journal_lock is not None:
+            self._journal_lock.close()
+            self._journal_lock = None
+        self._opened = False
+
+    def get_stats(self) -> dict:
+        """Buffer depth and write counters"""
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "reserved": self._reserved,
+            "pending_users": len(self._pending_by_user),
+            "journal": self.journal_name
+        }
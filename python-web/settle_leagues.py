@@ -0,0 +1,63 @@
+"""
+Settle a finished week's leagues (STORAGE_BACKEND=sql)
+Ranks every cohort, sets promoted / demoted and places everyone in next week's leagues.
+Safe to rerun: finished cohorts are skipped, so a crashed run picks up where it stopped.
+
+Usage:
+    python settle_leagues.py               # last week (UTC, like the XP aggregates)
+    python settle_leagues.py 2024-18       # ISO year and week
+    python settle_leagues.py 2024-18 --force
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal, init_async_db
+from database.models import League
+from services.sql_storage import SQLStorage
+
+
+def parse_week(text):
+    """(iso_year, iso_week) from 'YYYY-WW'"""
+    year, week = text.split("-")
+    return int(year), int(week.lstrip("Ww"))
+
+
+async def settle(week, force):
+    """Settle a week with leagues built from the League rows; returns False if there are none"""
+    # League rows are matched by name, so build the storage from what the database already has
+    await init_async_db()
+    async with AsyncSessionLocal() as db:
+        leagues = {row.name.lower(): {'name': row.name, 'min_xp': row.min_xp or 0}
+                   for row in await db.scalars(select(League))}
+    if not leagues:
+        return False
+
+    storage = SQLStorage(leagues)
+    start = time.perf_counter()
+    try:
+        summary = await storage.settle_week(week, force=force)
+    finally:
+        await storage.close()
+    for league_id, result in summary.items():
+        note = " (already settled)" if result.get("skipped") else ""
+        print(f"{league_id}: {result['participants']} participants, "
+              f"{result['promoted']} promoted, {result['demoted']} demoted{note}")
+    print(f"✅ Settled {week[0]}-W{week[1]:02d} in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--force"]
+    if len(args) > 1:
+        print(__doc__)
+        sys.exit(1)
+    week = parse_week(args[0]) if args else tuple((datetime.utcnow() - timedelta(days=7)).isocalendar()[:2])
+
+    if not asyncio.run(settle(week, force="--force" in sys.argv)):
+        print("No leagues in the database yet; start the app with STORAGE_BACKEND=sql first")
+        sys.exit(1)
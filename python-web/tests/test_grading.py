@@ -0,0 +1,88 @@
+"""
+Grading tests
+Normalization, accent folding for free-text answers and scoring
+"""
+
+import pytest
+
+from lessons_data import LessonCatalog
+from services.grading import PASSING_SCORE, CompiledQuiz, GradingEngine, normalize_answer
+
+QUESTIONS = {
+    1: {"id": 1, "type": "fill_blank", "question": "Good morning = Buenos ___", "correct": "días",
+        "accepted": ["dias de sol"]},
+    2: {"id": 2, "type": "multiple_choice", "question": "Coffee?", "correct": "Café"},
+    3: {"id": 3, "type": "fill_blank", "question": "Year", "correct": "año"},
+}
+
+
+@pytest.fixture
+def quiz():
+    return CompiledQuiz(7, QUESTIONS)
+
+
+@pytest.mark.parametrize("text, fold_accents, expected", [
+    ("  Buenos   Días ", False, "buenos días"),
+    ("  Buenos   Días ", True, "buenos dias"),
+    ("STRASSE", False, "strasse"),
+    ("Straße", False, "strasse"),                # casefold, not lower
+    ("cafe\u0301", False, "café"),               # combining accent composed to NFC
+    ("café", True, "cafe"),
+    ("Ñandú", True, "nandu"),
+])
+def test_normalize_answer(text, fold_accents, expected):
+    assert normalize_answer(text, fold_accents) == expected
+
+
+@pytest.mark.parametrize("answer", ["días", "DIAS", " dias ", "días", "Dias de  sol"])
+def test_fill_blank_ignores_accents_case_and_spacing(quiz, answer):
+    assert quiz.is_correct(1, answer)
+
+
+def test_fill_blank_folding_still_needs_the_right_letters(quiz):
+    assert not quiz.is_correct(3, "ano de")
+    assert quiz.is_correct(3, "ano")  # ñ folds to n in free-text answers
+    assert not quiz.is_correct(1, "dia")
+
+
+def test_choices_keep_accents(quiz):
+    assert quiz.is_correct(2, "café")
+    assert quiz.is_correct(2, "CAFE\u0301")  # same letters, decomposed
+    assert not quiz.is_correct(2, "cafe")
+
+
+def test_unknown_question_is_none(quiz):
+    assert quiz.is_correct(99, "anything") is None
+
+
+def test_grade_scores_ignores_unknown_and_repeated_questions(quiz):
+    result = quiz.grade([(1, "dias"), (1, "wrong"), (2, "cafe"), (99, "x"), (3, "Año")])
+    assert result["correct_answers"] == 2
+    assert result["total_questions"] == 3
+    assert result["score"] == 66
+    assert result["passed"] is (66 >= PASSING_SCORE)
+    assert [(row["question_id"], row["is_correct"]) for row in result["detailed_results"]] == [
+        (1, True), (2, False), (3, True)
+    ]
+
+
+def test_unanswered_quiz_scores_zero(quiz):
+    result = quiz.grade([])
+    assert (result["score"], result["passed"], result["detailed_results"]) == (0, False, [])
+
+
+def test_engine_grades_catalog_lessons_and_batches():
+    catalog = LessonCatalog([
+        {"id": 1, "level": "beginner", "quiz": list(QUESTIONS.values())},
+        {"id": 2, "level": "beginner", "quiz": []},
+    ])
+    engine = GradingEngine(catalog)
+
+    assert engine.get(2) is None
+    assert engine.grade(2, [(1, "días")]) is None
+    perfect = engine.grade(1, [(1, "DIAS"), (2, "Café"), (3, "ano")])
+    assert (perfect["score"], perfect["passed"]) == (100, True)
+
+    batch = engine.grade_batch([(1, [(1, "dias")]), (2, []), (3, [])])
+    assert batch[0]["correct_answers"] == 1
+    assert batch[1:] == [None, None]
@@ -0,0 +1,108 @@
+"""
+Leaderboard tests
+Ranks, ties and around() windows at the edges of the board
+"""
+
+import pytest
+
+from services.leaderboard import Leaderboard, LeagueLeaderboard
+
+
+def make_board(weekly_xp):
+    """Board with one user per entry, named u0, u1, ..."""
+    board = Leaderboard()
+    for i, xp in enumerate(weekly_xp):
+        board.update(f"u{i}", {"email": f"u{i}", "weekly_xp": xp})
+    return board
+
+
+def emails(rows):
+    return [row["email"] for row in rows]
+
+
+def test_rank_orders_by_weekly_xp_then_email():
+    board = make_board([10, 30, 20, 30])
+    assert [board.rank(f"u{i}") for i in range(4)] == [4, 1, 3, 2]
+
+
+def test_rank_of_unknown_user_is_none():
+    assert make_board([10]).rank("nobody") is None
+    assert Leaderboard().rank("nobody") is None
+
+
+def test_update_moves_a_user_and_remove_drops_them():
+    board = make_board([10, 20, 30])
+    board.update("u0", {"email": "u0", "weekly_xp": 40})
+    assert board.rank("u0") == 1
+    assert board.rank("u2") == 2
+
+    board.remove("u2")
+    board.remove("nobody")
+    assert len(board) == 2
+    assert board.rank("u2") is None
+    assert board.rank("u1") == 2
+
+
+def test_top_clamps_the_limit():
+    board = make_board([10, 20, 30])
+    assert emails(board.top(2)) == ["u2", "u1"]
+    assert emails(board.top(10)) == ["u2", "u1", "u0"]
+    assert board.top(0) == []
+    assert board.top(-1) == []
+
+
+@pytest.mark.parametrize("email, radius, expected", [
+    ("u2", 1, [("u1", 2), ("u2", 3), ("u3", 4)]),
+    ("u0", 2, [("u0", 1), ("u1", 2), ("u2", 3)]),           # clipped at the top
+    ("u4", 2, [("u2", 3), ("u3", 4), ("u4", 5)]),           # clipped at the bottom
+    ("u2", 0, [("u2", 3)]),
+    ("u2", -3, [("u2", 3)]),                                # negative radius means just the user
+    ("u2", 10, [("u0", 1), ("u1", 2), ("u2", 3), ("u3", 4), ("u4", 5)]),
+])
+def test_around_windows(email, radius, expected):
+    board = make_board([50, 40, 30, 20, 10])
+    assert [(row["email"], row["rank"]) for row in board.around(email, radius)] == expected
+
+
+def test_around_unknown_user_is_empty():
+    assert make_board([10, 20]).around("nobody", 3) == []
+
+
+def test_around_ranks_match_rank_with_ties():
+    board = make_board([20, 20, 20, 10])
+    for row in board.around("u1", 5):
+        assert row["rank"] == board.rank(row["email"])
+
+
+def test_rows_are_copies():
+    board = make_board([10])
+    board.get("u0")["weekly_xp"] = 99
+    board.around("u0", 1)[0]["weekly_xp"] = 99
+    assert board.get("u0")["weekly_xp"] == 10
+
+
+def test_frozen_board_is_read_only():
+    board = make_board([10]).freeze()
+    with pytest.raises(RuntimeError):
+        board.update("u1", {"email": "u1", "weekly_xp": 5})
+    with pytest.raises(RuntimeError):
+        board.remove("u0")
+    assert board.rank("u0") == 1
+
+
+def test_league_board_moves_users_between_partitions():
+    board = LeagueLeaderboard(["bronze", "silver"])
+    board.update("a", {"email": "a", "weekly_xp": 10, "league": "bronze"})
+    board.update("b", {"email": "b", "weekly_xp": 20, "league": "bronze"})
+    board.update("a", {"email": "a", "weekly_xp": 30, "league": "silver"})
+
+    assert board.league_of("a") == "silver"
+    assert emails(board.partition("bronze").top(10)) == ["b"]
+    assert emails(board.partition("silver").top(10)) == ["a"]
+    assert board.rank("a") == 1
+    assert board.partition("bronze").rank("b") == 1
+
+    board.remove("a")
+    assert board.league_of("a") is None
+    assert len(board.partition("silver")) == 0
+    assert len(board) == 1
@@ -0,0 +1,233 @@
+"""
+Storage tests
+The memory and SQL backends answer the same calls the same way
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from database import async_crud
+from database.models import UserProgress, XPWeekly
+from lessons_data import LESSON_CATALOG
+from services.promotions import PromotionRules
+from services.sql_storage import SQLStorage, week_bounds
+from services.storage import DuplicateUserError, MemoryStorage, UnknownUserError
+
+pytestmark = pytest.mark.anyio
+
+LEAGUES = {
+    'bronze': {'name': 'Bronze', 'min_xp': 0, 'promotion_threshold': 1, 'demotion_threshold': None},
+    'silver': {'name': 'Silver', 'min_xp': 500, 'promotion_threshold': None, 'demotion_threshold': 1},
+}
+
+
+def current_week():
+    return tuple(datetime.utcnow().isocalendar()[:2])
+
+
+def previous_week():
+    return tuple((datetime.utcnow() - timedelta(days=7)).isocalendar()[:2])
+
+
+@pytest.fixture(params=["memory", "sql", "sql_write_behind"])
+async def storage(request, tmp_path):
+    if request.param == "memory":
+        backend = MemoryStorage(LEAGUES.keys(), promotion_rules=PromotionRules(LEAGUES))
+    else:
+        # The write-behind variant reads most XP back from the ledger's buffer
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'speakeasy.db'}")
+        backend = SQLStorage(
+            LEAGUES,
+            LESSON_CATALOG.lessons,
+            session_factory=async_sessionmaker(engine, class_=AsyncSession, autoflush=False, expire_on_commit=False),
+            bind=engine,
+            xp_write_behind={
+                "flush_interval_ms": 60000,
+                "journal_path": str(tmp_path / "xp.journal")
+            } if request.param == "sql_write_behind" else None
+        )
+    await backend.init()
+    backend.start()
+    yield backend
+    await backend.stop()
+    await backend.close()
+
+
+async def register(storage, email, username=None):
+    return await storage.create_user({'email': email, 'username': username, 'target_language': 'Spanish'})
+
+
+async def award(storage, email, total_xp, weekly_xp, amount=0):
+    """Save an XP record and re-rank the user, the way the app does"""
+    xp_data = {
+        'total_xp': total_xp,
+        'weekly_xp': weekly_xp,
+        'streak_days': 1,
+        'last_active': datetime.utcnow().isoformat(),
+        'week': current_week()
+    }
+    await storage.save_xp(email, xp_data, amount, 'quiz')
+    await storage.update_leaderboard(email, xp_data, 'silver' if total_xp >= 500 else 'bronze')
+
+
+async def flush(storage):
+    """Write buffered XP; SQL boards rank on written XP only"""
+    if getattr(storage, 'xp_ledger', None) is not None:
+        await storage.xp_ledger.flush()
+
+
+async def test_users(storage):
+    user = await register(storage, 'ann@x.io', 'ann')
+    assert (user['email'], user['username']) == ('ann@x.io', 'ann')
+    assert (await storage.get_user('ann@x.io'))['username'] == 'ann'
+    assert await storage.get_user('nobody@x.io') is None
+    assert await storage.username_exists('ann')
+    assert not await storage.username_exists('bob')
+    with pytest.raises(DuplicateUserError):
+        await register(storage, 'ann@x.io')
+
+
+async def test_unknown_users_read_as_empty_and_cannot_be_written(storage):
+    assert await storage.get_lesson_progress('nobody@x.io') == {}
+    assert await storage.get_xp('nobody@x.io') is None
+
+    progress = {'lesson_id': 1, 'completed': True, 'score': 100, 'attempts': 1,
+                'last_attempt': datetime.utcnow().isoformat()}
+    with pytest.raises(UnknownUserError):
+        await storage.save_lesson_progress('nobody@x.io', progress, attempt={'answers': [], 'xp_earned': 100})
+    with pytest.raises(UnknownUserError):
+        await award(storage, 'nobody@x.io', 100, 100, 100)
+    assert await storage.get_user('nobody@x.io') is None
+    assert await storage.get_lesson_progress('nobody@x.io') == {}
+
+
+async def test_lesson_progress(storage):
+    await register(storage, 'ann@x.io')
+    for attempts, score in ((1, 40), (2, 100)):
+        await storage.save_lesson_progress('ann@x.io', {
+            'lesson_id': 1,
+            'completed': score >= 70,
+            'score': score,
+            'attempts': attempts,
+            'last_attempt': datetime.utcnow().isoformat()
+        }, attempt={'answers': [], 'xp_earned': 0})
+
+    progress = await storage.get_lesson_progress('ann@x.io')
+    assert list(progress) == [1]
+    record = progress[1]
+    assert (record['lesson_id'], record['completed'], record['score'], record['attempts']) == (1, True, 100, 2)
+
+
+async def test_lesson_progress_is_a_copy(storage):
+    await register(storage, 'ann@x.io')
+    await storage.save_lesson_progress('ann@x.io', {
+        'lesson_id': 1, 'completed': False, 'score': 0, 'attempts': 1,
+        'last_attempt': datetime.utcnow().isoformat()
+    }, attempt={'answers': [], 'xp_earned': 0})
+
+    progress = await storage.get_lesson_progress('ann@x.io')
+    progress[1]['attempts'] = 99
+    progress[2] = {'lesson_id': 2}
+    assert (await storage.get_lesson_progress('ann@x.io')) == {1: {**progress[1], 'attempts': 1}}
+
+
+async def test_xp_and_activity(storage):
+    await register(storage, 'ann@x.io')
+    await award(storage, 'ann@x.io', 100, 100, 100)
+    await award(storage, 'ann@x.io', 130, 130, 30)
+
+    xp = await storage.get_xp('ann@x.io')
+    assert (xp['total_xp'], xp['weekly_xp'], xp['streak_days'], xp['week']) == (130, 130, 1, current_week())
+    today = datetime.utcnow().date()
+    assert await storage.xp_activity('ann@x.io', today, today) == {today: 130}
+
+
+async def test_leaderboard(storage):
+    # Created in email order, so ties break the same way on both backends (email / user id)
+    for email, total_xp, weekly_xp in (('a@x.io', 600, 600), ('b@x.io', 50, 50), ('c@x.io', 120, 120),
+                                       ('d@x.io', 50, 50)):
+        await register(storage, email)
+        await award(storage, email, total_xp, weekly_xp, weekly_xp)
+    await flush(storage)
+
+    board = await storage.leaderboard(current_week())
+    assert await board.count() == 4
+    assert [row['email'] for row in await board.top(10)] == ['a@x.io', 'c@x.io', 'b@x.io', 'd@x.io']
+    assert [await board.rank(email) for email in ('a@x.io', 'b@x.io', 'c@x.io', 'd@x.io')] == [1, 3, 2, 4]
+    assert await board.rank('nobody@x.io') is None
+    assert [(row['email'], row['rank']) for row in await board.around('b@x.io', 1)] == [
+        ('c@x.io', 2), ('b@x.io', 3), ('d@x.io', 4)
+    ]
+    assert await board.league_of('a@x.io') == 'silver'
+    assert await board.league_of('b@x.io') == 'bronze'
+
+    bronze = board.partition('bronze')
+    assert [row['email'] for row in await bronze.top(10)] == ['c@x.io', 'b@x.io', 'd@x.io']
+    assert await bronze.rank('d@x.io') == 3
+    assert await board.partition('silver').count() == 1
+
+
+async def test_promotion_holds_for_the_week(storage):
+    await register(storage, 'ann@x.io')
+    await award(storage, 'ann@x.io', 600, 600, 600)
+    # A lower league from the XP rules never moves a user down mid-week
+    xp_data = {'total_xp': 600, 'weekly_xp': 610, 'streak_days': 1,
+               'last_active': datetime.utcnow().isoformat(), 'week': current_week()}
+    await storage.update_leaderboard('ann@x.io', xp_data, 'bronze')
+    board = await storage.leaderboard(current_week())
+    assert await board.league_of('ann@x.io') == 'silver'
+
+
+async def place(storage, week, email, league_id, weekly_xp, total_xp):
+    """Rank a registered user in a league for a week with the given XP"""
+    xp_data = {'total_xp': total_xp, 'weekly_xp': weekly_xp, 'streak_days': 1,
+               'last_active': datetime.utcnow().isoformat(), 'week': week}
+    await storage.update_leaderboard(email, xp_data, league_id)
+    if isinstance(storage, SQLStorage):
+        # SQL boards rank the XP written for the week, which awards made now can't backdate
+        async with storage.session() as db:
+            user_id = (await async_crud.get_user_by_email(db, email)).id
+            await db.execute(update(XPWeekly).where(
+                XPWeekly.user_id == user_id, XPWeekly.week_start == week_bounds(week)[0]
+            ).values(xp=weekly_xp))
+            await db.execute(update(UserProgress).where(UserProgress.user_id == user_id).values(total_xp=total_xp))
+            await db.commit()
+
+
+async def settlement(storage, week, next_week, emails):
+    """{email: (promoted, demoted, league next week)}"""
+    rows = {row['email']: row for row in await (await storage.leaderboard(week)).top(10)}
+    next_board = await storage.leaderboard(next_week)
+    return {email: (rows[email]['promoted'], rows[email]['demoted'], await next_board.league_of(email))
+            for email in emails}
+
+
+async def test_settle_week_is_idempotent(storage):
+    week, next_week = previous_week(), current_week()
+    placements = (('a@x.io', 'bronze', 50, 100), ('b@x.io', 'bronze', 10, 100),
+                  ('c@x.io', 'silver', 30, 600), ('d@x.io', 'silver', 5, 450))
+    for email, league_id, weekly_xp, total_xp in placements:
+        await register(storage, email)
+        await place(storage, week, email, league_id, weekly_xp, total_xp)
+    emails = [email for email, *_ in placements]
+
+    await storage.leaderboard(next_week)  # the memory backend archives the week and settles it in the background
+    await storage.settle_week(week)
+    settled = await settlement(storage, week, next_week, emails)
+    assert settled == {
+        'a@x.io': (True, False, 'silver'),
+        'b@x.io': (False, False, 'bronze'),
+        'c@x.io': (False, False, 'silver'),
+        'd@x.io': (False, True, 'bronze'),  # d's total XP no longer holds silver
+    }
+
+    await storage.settle_week(week)
+    assert await settlement(storage, week, next_week, emails) == settled
+
+    summary = await storage.settle_week(week, force=True)
+    assert await settlement(storage, week, next_week, emails) == settled
+    assert {league_id: (cohort['participants'], cohort['promoted'], cohort['demoted'])
+            for league_id, cohort in summary.items()} == {'bronze': (2, 1, 0), 'silver': (2, 0, 1)}
@@ -0,0 +1,150 @@
+"""
+XP ledger tests
+Journal recovery after a crash, backpressure and reservations
+"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from services.xp_ledger import XPLedger, XPLedgerFull
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeDatabase:
+    """write / checkpoint callbacks keeping awards and per-journal checkpoints in memory"""
+
+    def __init__(self):
+        self.awards = []
+        self.checkpoints = {}
+        self.fail = False
+
+    async def write(self, awards, journal, last_seq):
+        if self.fail:
+            raise RuntimeError("database down")
+        self.awards.extend(dict(award) for award in awards)
+        if journal is not None:
+            self.checkpoints[journal] = last_seq
+
+    async def checkpoint(self, journal):
+        return self.checkpoints.get(journal, 0)
+
+
+def make_ledger(db, journal_path=None, **options):
+    return XPLedger(db.write, db.checkpoint, journal_path=journal_path, **options)
+
+
+def journal_line(seq, user_id=1, amount=10):
+    return json.dumps({
+        "seq": seq, "user_id": user_id, "amount": amount, "source": "quiz", "source_id": None,
+        "description": None, "created_at": datetime(2026, 1, 5, 12, 0).isoformat()
+    }) + "\n"
+
+
+async def test_recovery_replays_only_awards_past_the_checkpoint(tmp_path):
+    journal = tmp_path / "xp.journal"
+    db = FakeDatabase()
+    first = make_ledger(db, str(journal))
+    await first.open()
+    db.checkpoints[first.journal_name] = 5  # seq 1-5 reached the database before the crash
+    first.close()
+
+    # The process died after writing 1-5 but before compacting the journal; 9 was torn mid-write
+    journal.write_text("".join(journal_line(seq) for seq in range(1, 9)) + '{"seq": 9, "user_')
+
+    ledger = make_ledger(db, str(journal))
+    await ledger.open()
+    assert ledger.get_stats()["recovered"] == 3
+    assert ledger.pending(1) == 30
+    assert ledger.pending_days(1) == {datetime(2026, 1, 5).date(): 30}
+
+    await ledger.add(1, 7, "story")
+    assert await ledger.flush() == 4
+    assert [award["seq"] for award in db.awards] == [6, 7, 8, 9]
+    assert db.checkpoints[ledger.journal_name] == 9
+    assert ledger.pending(1) == 0
+    ledger.close()
+
+    # Everything is written, so another restart replays nothing
+    again = make_ledger(db, str(journal))
+    await again.open()
+    assert again.get_stats()["recovered"] == 0
+    again.close()
+
+
+async def test_unflushed_awards_survive_a_restart(tmp_path):
+    journal = str(tmp_path / "xp.journal")
+    db = FakeDatabase()
+    ledger = make_ledger(db, journal)
+    await ledger.add(1, 10, "quiz")
+    await ledger.flush()
+    await ledger.add(2, 20, "quiz")
+    ledger.close()  # crash: nothing else is flushed
+
+    restarted = make_ledger(db, journal)
+    await restarted.open()
+    assert restarted.pending(2) == 20
+    await restarted.flush()
+    assert [(award["user_id"], award["amount"]) for award in db.awards] == [(1, 10), (2, 20)]
+    restarted.close()
+
+
+async def test_full_buffer_flushes_before_accepting_more():
+    db = FakeDatabase()
+    ledger = make_ledger(db, batch_rows=2, max_pending=2)
+    for amount in (1, 2, 3):
+        await ledger.add(1, amount, "quiz")
+    assert [award["amount"] for award in db.awards] == [1, 2]
+    assert ledger.pending(1) == 3
+    assert ledger.get_stats()["backpressure_waits"] == 1
+
+
+async def test_full_buffer_raises_when_the_flush_fails():
+    db = FakeDatabase()
+    ledger = make_ledger(db, batch_rows=1, max_pending=1)
+    await ledger.add(1, 10, "quiz")
+    db.fail = True
+    with pytest.raises(XPLedgerFull):
+        await ledger.add(1, 20, "quiz")
+    assert ledger.pending(1) == 10
+
+
+async def test_reserve_fails_before_the_caller_writes_anything():
+    db = FakeDatabase()
+    ledger = make_ledger(db, batch_rows=1, max_pending=1)
+    await ledger.add(1, 10, "quiz")
+    db.fail = True
+
+    side_effects = []
+    with pytest.raises(XPLedgerFull):
+        async with ledger.reserve():
+            side_effects.append("attempt saved")
+    assert side_effects == []
+    assert ledger.get_stats()["reserved"] == 0
+
+
+async def test_reserved_add_never_waits_for_room():
+    db = FakeDatabase()
+    ledger = make_ledger(db, batch_rows=1, max_pending=1)
+    async with ledger.reserve():
+        assert ledger.get_stats()["reserved"] == 1
+        db.fail = True  # the database goes away after the room was reserved
+        async with ledger.reserve():  # nested blocks share the reservation
+            await ledger.add(1, 10, "quiz")
+    assert ledger.pending(1) == 10
+    assert ledger.get_stats()["reserved"] == 0
+
+    # The held room was used; the next award has to wait for a flush again, which fails
+    with pytest.raises(XPLedgerFull):
+        await ledger.add(1, 20, "quiz")
+
+
+async def test_unused_reservation_is_released():
+    ledger = make_ledger(FakeDatabase(), batch_rows=1, max_pending=1)
+    async with ledger.reserve():
+        pass
+    assert ledger.get_stats()["reserved"] == 0
+    await ledger.add(1, 10, "quiz")
+    assert ledger.pending(1) == 10